@@ -3,14 +3,27 @@
 # הרצה בענן: Streamlit Cloud (הכל דרך st.secrets)
 
 from __future__ import annotations
-import sqlite3
-import json
-from datetime import datetime, timedelta, timezone
-from typing import Optional, Tuple, List
+import os
+import tempfile
+from datetime import datetime, timezone
 
 import pandas as pd
 import streamlit as st
 
+from quality_core import (
+    BRANCHES, DISHES, DUP_HOURS, MIN_BRANCH_LEADER_N, MIN_CHEF_TOP_M, TREND_DAYS, ANOMALY_Z,
+    GPT_MODEL, GPT_PING_TIMEOUT_S, GPT_TOKEN_BUDGET,
+    ensure_db, refresh_df, rebuild_rollups, load_kpis,
+    kpi_best_branch_by_count, kpi_best_avg_branch, kpi_top_chef, kpi_top_dish,
+    score_hint, has_recent_duplicate, insert_record, import_records, history_page, history_chefs,
+    load_trends, trends_as_of, trend_series,
+    save_to_google_sheets, sheets_worker, outbox_pending, outbox_failed, outbox_retry_failed,
+    openai_config_error, get_openai_client, data_version, llm_digest, cached_answer_stream,
+    TRACES, begin_run, end_run, budget_report, trace, EXPORT_FORMATS, write_export,
+)
+
+begin_run()
+
 # ---------- עיצוב בסיסי ----------
 st.set_page_config(page_title="🍜 ג'ירף מטבחים – איכויות אוכל", layout="wide")
 st.markdown("""
@@ -30,222 +43,7 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# ---------- קבועים ----------
-BRANCHES: List[str] = ["חיפה","ראשל״צ","רמה״ח","נס ציונה","לנדמרק","פתח תקווה","הרצליה","סביון"]
-DISHES:   List[str] = ["פאד תאי","מלאזית","פיליפינית","אפגנית","קארי דלעת","סצ'ואן","ביף רייס","אורז מטוגן",
-                       "מאקי סלמון","מאקי טונה","ספייסי סלמון","נודלס ילדים"]
-DB_PATH = "food_quality.db"
-DUP_HOURS = 12
-MIN_BRANCH_LEADER_N = 3
-MIN_CHEF_TOP_M = 5
-
-# ---------- DB ----------
-def conn() -> sqlite3.Connection:
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
-
-SCHEMA = """
-CREATE TABLE IF NOT EXISTS food_quality (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  branch TEXT NOT NULL,
-  chef_name TEXT NOT NULL,
-  dish_name TEXT NOT NULL,
-  score INTEGER NOT NULL CHECK(score BETWEEN 1 AND 10),
-  notes TEXT,
-  created_at TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP),
-  submitted_by TEXT
-);
-"""
-INDEXES = [
-    "CREATE INDEX IF NOT EXISTS idx_food_branch_time ON food_quality(branch, created_at)",
-    "CREATE INDEX IF NOT EXISTS idx_food_chef_dish_time ON food_quality(chef_name, dish_name, created_at)",
-]
-def init_db():
-    c = conn(); cur = c.cursor()
-    cur.execute(SCHEMA)
-    for q in INDEXES: cur.execute(q)
-    c.commit(); c.close()
-init_db()
-
-@st.cache_data(ttl=15)
-def load_df() -> pd.DataFrame:
-    c = conn()
-    df = pd.read_sql_query(
-        "SELECT id, branch, chef_name, dish_name, score, notes, created_at FROM food_quality ORDER BY created_at DESC", c
-    )
-    c.close()
-    return df
-
-def refresh_df(): load_df.clear()
-
-# ---------- שכבת Secrets: Sheets ----------
-try:
-    import gspread
-    from google.oauth2.service_account import Credentials
-    GSHEETS_AVAILABLE = True
-except Exception:
-    GSHEETS_AVAILABLE = False
-
-SCOPES = ["https://www.googleapis.com/auth/spreadsheets",
-          "https://www.googleapis.com/auth/drive"]
-
-def _normalize_private_key(creds: dict) -> dict:
-    """מתקן את ה-private key - מחליף \\n ב-\n אם נדרש"""
-    pk = creds.get("private_key")
-    if isinstance(pk, str) and "\\n" in pk:
-        creds = creds.copy()
-        creds["private_key"] = pk.replace("\\n", "\n")
-    return creds
-
-def _get_sheets_config():
-    """מחזיר את הגדרות החיבור לגוגל שיטס"""
-    try:
-        sheet_url = st.secrets.get("GOOGLE_SHEET_URL")
-        sheet_id = st.secrets.get("GOOGLE_SHEET_ID")
-        sheet_title = st.secrets.get("GOOGLE_SHEET_TITLE")
-        ws_name = st.secrets.get("GOOGLE_SHEET_WORKSHEET", "sheet1")
-
-        # נסה לקבל את ה-service account credentials
-        creds_dict = dict(st.secrets.get("google_service_account", {}))
-        
-        if not creds_dict:
-            return None, None, ws_name
-            
-        # תקן את ה-private key
-        creds_dict = _normalize_private_key(creds_dict)
-        
-        # וודא שיש את כל השדות הנדרשים
-        required_fields = ["type", "project_id", "private_key", "client_email", "client_id", "token_uri"]
-        missing_fields = [field for field in required_fields if field not in creds_dict]
-        
-        if missing_fields:
-            st.error(f"חסרים שדות ב-google_service_account: {', '.join(missing_fields)}")
-            return None, None, ws_name
-
-        identifier = sheet_url or sheet_id or sheet_title
-        return creds_dict, identifier, ws_name
-        
-    except Exception as e:
-        st.error(f"שגיאה בקריאת הגדרות Sheets: {e}")
-        return None, None, "sheet1"
-
-def _open_spreadsheet(gc, identifier: str):
-    """פותח את הגיליון לפי מזהה - URL, ID או כותרת"""
-    if identifier.startswith("http"):
-        return gc.open_by_url(identifier)
-    if "/" not in identifier and " " not in identifier:
-        try:
-            return gc.open_by_key(identifier)
-        except Exception:
-            pass
-    return gc.open(identifier)
-
-def save_to_google_sheets(branch: str, chef: str, dish: str, score: int, notes: str, ts: str) -> bool:
-    """שומר רשומה לגוגל שיטס"""
-    if not GSHEETS_AVAILABLE:
-        st.warning("gspread/google-auth לא מותקנות — לא ניתן לכתוב לגיליון.")
-        return False
-        
-    creds_dict, identifier, ws_name = _get_sheets_config()
-    
-    if not creds_dict:
-        st.warning("חסרות הגדרות google_service_account ב-secrets.toml")
-        return False
-        
-    if not identifier:
-        st.warning("חסר מזהה גיליון (GOOGLE_SHEET_URL/ID/TITLE) ב-secrets.toml")
-        return False
-        
-    try:
-        # יצירת credentials ואימות
-        credentials = Credentials.from_service_account_info(creds_dict, scopes=SCOPES)
-        gc = gspread.authorize(credentials)
-        
-        # פתיחת הגיליון
-        sh = _open_spreadsheet(gc, identifier)
-        
-        # פתיחת/יצירת worksheet
-        try:
-            ws = sh.worksheet(ws_name)
-        except Exception:
-            ws = sh.add_worksheet(title=ws_name, rows=1000, cols=12)
-            # הוספת כותרות אם זה worksheet חדש
-            ws.append_row(["תאריך/שעה", "סניף", "שם טבח", "מנה", "ציון", "הערות"])
-        
-        # הוספת השורה
-        ws.append_row([ts, branch, chef, dish, score, notes or ""], value_input_option="USER_ENTERED")
-        return True
-        
-    except Exception as e:
-        st.error(f"שגיאת Google Sheets: {e}")
-        return False
-
-# ---------- שכבת Secrets: GPT ----------
-def get_openai_client():
-    """מחזיר OpenAI client או שגיאה"""
-    api_key = st.secrets.get("OPENAI_API_KEY", "")
-    if not api_key or api_key == "sk-PASTE_YOUR_KEY_HERE":
-        return None, "חסר OPENAI_API_KEY תקין ב-secrets.toml"
-        
-    org = st.secrets.get("OPENAI_ORG", "")
-    proj = st.secrets.get("OPENAI_PROJECT", "")
-    
-    try:
-        from openai import OpenAI
-        kw = {"api_key": api_key}
-        if org: kw["organization"] = org
-        if proj: kw["project"] = proj
-        return OpenAI(**kw), None
-    except Exception as e:
-        return None, f"שגיאת OpenAI: {e}"
-
-# ---------- לוגיקה ----------
-def score_hint(x:int)->str: 
-    return "😟 חלש" if x<=3 else ("🙂 סביר" if x<=6 else ("😀 טוב" if x<=8 else "🤩 מצוין"))
-
-def has_recent_duplicate(branch:str, chef:str, dish:str, hours:int=DUP_HOURS)->bool:
-    if hours<=0: return False
-    cutoff = (datetime.now(timezone.utc)-timedelta(hours=hours)).strftime("%Y-%m-%d %H:%M:%S")
-    c = conn(); cur = c.cursor()
-    cur.execute("""SELECT 1 FROM food_quality WHERE branch=? AND chef_name=? AND dish_name=? AND created_at >= ? LIMIT 1""",
-                (branch.strip(), chef.strip(), dish.strip(), cutoff))
-    ok = cur.fetchone() is not None
-    c.close(); return ok
-
-def insert_record(branch:str, chef:str, dish:str, score:int, notes:str, submitted_by:Optional[str]=None):
-    ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
-    # SQLite
-    c = conn(); cur = c.cursor()
-    cur.execute("""INSERT INTO food_quality (branch, chef_name, dish_name, score, notes, created_at, submitted_by)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                (branch.strip(), chef.strip(), dish.strip(), int(score), (notes or "").strip(), ts, submitted_by))
-    c.commit(); c.close()
-    # Sheets
-    ok = save_to_google_sheets(branch, chef, dish, score, notes, ts)
-    st.toast("נשמר גם ל-Google Sheets ✅" if ok else "נשמר מקומית בלבד ℹ️", icon="✅" if ok else "ℹ️")
-
-def kpi_best_branch_by_count(df:pd.DataFrame)->Tuple[Optional[str],int]:
-    if df.empty: return None,0
-    s = df.groupby("branch")["id"].count().sort_values(ascending=False)
-    return s.index[0], int(s.iloc[0])
-
-def kpi_best_avg_branch(df:pd.DataFrame, min_n:int)->Tuple[Optional[str],Optional[float],int]:
-    if df.empty: return None,None,0
-    g = df.groupby("branch").agg(n=("id","count"), avg=("score","mean")).reset_index().sort_values(["avg","n"],ascending=[False,False])
-    leader = g[g["n"]>=min_n]
-    row = (leader if not leader.empty else g).iloc[0]
-    return str(row["branch"]), float(row["avg"]), int(row["n"])
-
-def kpi_top_chef(df:pd.DataFrame, min_m:int)->Tuple[Optional[str],Optional[float],int]:
-    if df.empty: return None,None,0
-    g = df.groupby("chef_name").agg(n=("id","count"), avg=("score","mean")).reset_index().sort_values(["n","avg"],ascending=[False,False])
-    qual = g[g["n"]>=min_m]
-    pick = qual.iloc[0] if not qual.empty else g.iloc[0]
-    return str(pick["chef_name"]), float(pick["avg"]), int(pick["n"])
-
-def kpi_top_dish(df:pd.DataFrame)->Tuple[Optional[str],int]:
-    if df.empty: return None,0
-    s = df.groupby("dish_name")["id"].count().sort_values(ascending=False)
-    return s.index[0], int(s.iloc[0])
+ensure_db()
 
 # ---------- התחברות (בחירת מצב) ----------
 def require_auth()->dict:
@@ -301,22 +99,25 @@ if st.button("💾 שמור בדיקה", type="primary"):
         if (not override) and has_recent_duplicate(selected_branch, chef, dish, DUP_HOURS):
             st.warning("נמצאה בדיקה קודמת לאותו סניף/טבח/מנה ב-12 השעות האחרונות. סמן 'שמור גם אם…' כדי לאשר.")
         else:
-            insert_record(selected_branch, chef, dish, score, notes, submitted_by=auth["role"])
+            with trace("insert_record", rows=1):
+                insert_record(selected_branch, chef, dish, score, notes, submitted_by=auth["role"])
             st.success(f"✅ נשמר: **{selected_branch} · {chef} · {dish}** • ציון **{score}**")
             refresh_df()
 st.markdown('</div>', unsafe_allow_html=True)
 
 # ---------- KPI ----------
-df = load_df()
+with trace("load_kpis", cache_hit=True) as _rec:
+    kpis = load_kpis(MIN_BRANCH_LEADER_N, MIN_CHEF_TOP_M)
+    _rec["rows"] = len(kpis)
 st.markdown('<div class="card">', unsafe_allow_html=True)
 st.subheader("📊 מדדים")
-if df.empty:
+if kpis.empty:
     st.info("אין נתונים להצגה עדיין.")
 else:
-    best_branch, best_branch_count = kpi_best_branch_by_count(df)
-    best_avg_branch, best_avg_value, best_avg_n = kpi_best_avg_branch(df, MIN_BRANCH_LEADER_N)
-    top_chef, top_chef_avg, top_chef_n = kpi_top_chef(df, MIN_CHEF_TOP_M)
-    top_dish, top_dish_count = kpi_top_dish(df)
+    best_branch, best_branch_count = kpi_best_branch_by_count(kpis)
+    best_avg_branch, best_avg_value, best_avg_n = kpi_best_avg_branch(kpis, MIN_BRANCH_LEADER_N)
+    top_chef, top_chef_avg, top_chef_n = kpi_top_chef(kpis, MIN_CHEF_TOP_M)
+    top_dish, top_dish_count = kpi_top_dish(kpis)
 
     c1,c2,c3,c4 = st.columns(4)
     with c1:
@@ -334,60 +135,144 @@ else:
         st.write("אין נתונים" if not top_dish else f"**{top_dish}** — {top_dish_count}")
 st.markdown('</div>', unsafe_allow_html=True)
 
+# ---------- מגמות וחריגים ----------
+# סניף רואה רק (סניף, מנה) של עצמו; מטה בוחר גם (טבח, מנה)
+TREND_LABELS = {"branch_dish": ("סניף", "מנה"), "chef_dish": ("טבח", "מנה")}
+st.markdown('<div class="card">', unsafe_allow_html=True)
+st.subheader("📈 מגמות")
+t_kind = "branch_dish"
+if auth["role"]=="meta":
+    t_kind = st.radio("צירוף", options=list(TREND_LABELS), format_func=lambda k: " · ".join(TREND_LABELS[k]),
+                      horizontal=True, key="t_kind")
+trends = load_trends(t_kind)
+if auth["role"]!="meta":
+    trends = trends[trends.index.get_level_values(0)==auth["branch"]]
+as_of = trends_as_of()
+if trends.empty or as_of is None:
+    st.info("אין נתונים להצגה עדיין.")
+else:
+    lbl1, lbl2 = TREND_LABELS[t_kind]
+    def trend_table(df: pd.DataFrame):
+        cols = {"mean_recent": "ממוצע אחרון", "baseline": "בסיס", "z": "z", "ewm": "EWM", "trend": "שינוי",
+                "n_recent": f"ב-{TREND_DAYS} ימים"}
+        view = df[list(cols)].rename(columns=cols).round(2).rename_axis([lbl1, lbl2]).reset_index()
+        st.dataframe(view, use_container_width=True, hide_index=True)
+    t1,t2 = st.columns(2)
+    with t1:
+        st.markdown("#### 🚨 חריגים")
+        anomalies = trends[trends["anomaly"]].sort_values("z", key=abs, ascending=False)
+        if anomalies.empty: st.write("אין חריגים בחלון האחרון.")
+        else: trend_table(anomalies)
+    with t2:
+        st.markdown("#### 📉 בירידה")
+        declining = trends[trends["trend"] < 0].nsmallest(10, "trend")
+        if declining.empty: st.write("אין צירופים בירידה.")
+        else: trend_table(declining)
+
+    pairs = {f"{k1} · {k2}": (k1, k2) for k1, k2 in sorted(trends.index.tolist())}
+    pair = st.selectbox("גרף לצירוף", options=list(pairs), key="t_pair")
+    series = trend_series(t_kind, *pairs[pair])
+    st.line_chart(series[["mean", "rolling", "ewm"]].rename(
+        columns={"mean": "ממוצע שבועי", "rolling": f"ממוצע נע ({TREND_DAYS} ימים)", "ewm": "EWM"}))
+    st.caption(f"נכון לשבוע שמתחיל ב-{as_of:%d/%m/%Y} · חריג = |z| ≥ {ANOMALY_Z} מול הממוצע שלפני החלון")
+st.markdown('</div>', unsafe_allow_html=True)
+
+# ---------- היסטוריה (מטה) ----------
+if auth["role"]=="meta":
+    st.markdown('<div class="card">', unsafe_allow_html=True)
+    st.subheader("🗂️ היסטוריית בדיקות")
+    ALL = "הכל"
+    h1,h2,h3 = st.columns(3)
+    with h1: h_branch = st.selectbox("סניף", options=[ALL]+BRANCHES, key="h_branch")
+    with h2: h_chef = st.selectbox("טבח", options=[ALL]+history_chefs(None if h_branch==ALL else h_branch), key="h_chef")
+    with h3: h_dish = st.selectbox("מנה", options=[ALL]+DISHES, key="h_dish")
+    h4,h5,h6 = st.columns(3)
+    with h4: h_from = st.date_input("מתאריך", value=None, key="h_from")
+    with h5: h_to = st.date_input("עד תאריך", value=None, key="h_to")
+    with h6: h_score = st.slider("טווח ציונים", 1, 10, (1, 10), key="h_score")
+    filters = dict(branch=None if h_branch==ALL else h_branch, chef=None if h_chef==ALL else h_chef,
+                   dish=None if h_dish==ALL else h_dish,
+                   date_from=h_from.isoformat() if h_from else None, date_to=h_to.isoformat() if h_to else None,
+                   score_min=h_score[0], score_max=h_score[1])
+
+    # מחסנית סמנים: [None, סמן עמוד 2, ...] — שינוי סינון מאפס לעמוד הראשון
+    if st.session_state.get("h_filters") != filters:
+        st.session_state.h_filters, st.session_state.h_cursors = filters, [None]
+    cursors = st.session_state.h_cursors
+    page, next_cursor = history_page(**filters, after=cursors[-1])
+    if page.empty:
+        st.info("אין בדיקות שתואמות לסינון.")
+    else:
+        st.dataframe(page.drop(columns=["id"]), use_container_width=True, hide_index=True)
+    p1,p2,p3 = st.columns([1,1,3])
+    with p1:
+        if st.button("→ הקודם", disabled=len(cursors)==1):
+            cursors.pop(); st.rerun()
+    with p2:
+        if st.button("הבא ←", disabled=next_cursor is None):
+            cursors.append(next_cursor); st.rerun()
+    with p3: st.caption(f"עמוד {len(cursors)}")
+    st.markdown('</div>', unsafe_allow_html=True)
+
 # ---------- GPT ----------
+SYSTEM_ANALYST = ("אתה אנליסט דאטה דובר עברית. מקבל תקציר סטטיסטי של בדיקות איכות אוכל "
+                  "(ציון 1–10) לפי סניף, מנה וטבח, כולל מגמות, חריגים והערות נבחרות.")
 st.markdown('<div class="card">', unsafe_allow_html=True)
 st.subheader("🤖 ניתוח GPT")
-gpt_client, gpt_err = get_openai_client()
+gpt_err = openai_config_error()  # ה-client עצמו נבנה רק כשלוחצים
 if gpt_err:
     st.warning(gpt_err)
 else:
     # בדיקת חיבור
     if st.button("🔎 בדיקת חיבור ל-GPT"):
         try:
-            ping = gpt_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role":"system","content":"You are a ping responder."},
-                          {"role":"user","content":"ping"}],
-                temperature=0.0,
-            )
+            gpt_client, err = get_openai_client()
+            if err: raise RuntimeError(err)
+            with trace("openai_ping"):
+                ping = gpt_client.chat.completions.create(
+                    model=GPT_MODEL,
+                    messages=[{"role":"system","content":"You are a ping responder."},
+                              {"role":"user","content":"ping"}],
+                    temperature=0.0,
+                    max_tokens=5,
+                    timeout=GPT_PING_TIMEOUT_S,
+                )
             msg = (ping.choices[0].message.content or "").strip()
             st.success(f"GPT מחובר. תשובה: {msg[:100]}")
         except Exception as e:
             st.error(f"שגיאת GPT: {e}")
 
-    if df.empty:
+    if kpis.empty:
         st.info("אין נתונים לניתוח.")
     else:
-        def df_to_csv_for_llm(dfin:pd.DataFrame, max_rows:int=400)->str:
-            d = dfin.copy()
-            if len(d)>max_rows: d = d.head(max_rows)
-            return d.to_csv(index=False)
-
         q_col, btn_col = st.columns([3,1])
         with q_col: user_q = st.text_input("שאלה על הנתונים (אופציונלי)")
         with btn_col: ask_btn = st.button("שלח")
         overview_btn = st.button("ניתוח כללי")
 
         if overview_btn or ask_btn:
-            csv_text = df_to_csv_for_llm(df)
+            version = data_version()
+            with trace("llm_digest", cache_hit=True):
+                digest = llm_digest(version, GPT_TOKEN_BUDGET)
             if overview_btn:
-                user_prompt = f"הנה הטבלה בפורמט CSV:\n{csv_text}\n\nסכם מגמות, חריגים והמלצות קצרות."
+                user_prompt = f"הנה תקציר כל הבדיקות:\n{digest}\n\nסכם מגמות, חריגים והמלצות קצרות."
             else:
-                user_prompt = f"שאלה: {user_q}\n\nהנה הטבלה (CSV, עד 400 שורות):\n{csv_text}\n\nענה בעברית, עם נימוק קצר."
-
-            with st.spinner("מנתח..."):
-                try:
-                    resp = gpt_client.chat.completions.create(
-                        model="gpt-4o-mini",
-                        messages=[{"role":"system","content":
-                                   "אתה אנליסט דאטה דובר עברית. העמודות: id, branch, chef_name, dish_name, score, notes, created_at."},
-                                  {"role":"user","content": user_prompt}],
-                        temperature=0.2,
-                    )
-                    ans = (resp.choices[0].message.content or "").strip()
-                    st.write(ans)
-                except Exception as e:
-                    st.error(f"שגיאת GPT: {e}")
+                user_prompt = f"שאלה: {user_q}\n\nהנה תקציר כל הבדיקות:\n{digest}\n\nענה בעברית, עם נימוק קצר."
+
+            try:
+                gpt_client, err = get_openai_client()
+                if err: raise RuntimeError(err)
+                answer, from_cache = cached_answer_stream(
+                    gpt_client, SYSTEM_ANALYST, user_prompt,
+                    question="__overview__" if overview_btn else user_q, version=version)
+                if not from_cache:
+                    # כל לחיצה בזמן הזרמה מפעילה rerun שעוצר את הזרם
+                    st.button("⏹️ עצור", key="gpt_stop")
+                st.write_stream(answer)
+                if from_cache:
+                    st.caption("⚡ תשובה שמורה — הנתונים לא השתנו מאז שנשאלה אותה שאלה")
+            except Exception as e:
+                st.error(f"שגיאת GPT: {e}")
 st.markdown('</div>', unsafe_allow_html=True)
 
 # ---------- Admin ----------
@@ -423,26 +308,107 @@ st.markdown('</div>', unsafe_allow_html=True)
 if st.session_state.get("admin_logged_in", False):
     st.markdown('<div class="card">', unsafe_allow_html=True)
     st.subheader("📥 ייצוא ובדיקות")
-    data = load_df().to_csv(index=False).encode("utf-8")
-    st.download_button("⬇️ הורדת CSV", data=data, file_name="food_quality_export.csv", mime="text/csv")
+    # ייצוא — הקובץ נבנה רק בלחיצה, בחלקים מה-DB
+    with st.expander("⬇️ ייצוא נתונים"):
+        e1,e2,e3,e4 = st.columns(4)
+        with e1: ex_branch = st.selectbox("סניף", options=["הכל"]+BRANCHES, key="ex_branch")
+        with e2: ex_from = st.date_input("מתאריך", value=None, key="ex_from")
+        with e3: ex_to = st.date_input("עד תאריך", value=None, key="ex_to")
+        with e4: ex_fmt = st.selectbox("פורמט", options=list(EXPORT_FORMATS), format_func=lambda f: EXPORT_FORMATS[f][0], key="ex_fmt")
+        ex_filters = dict(branch=None if ex_branch=="הכל" else ex_branch,
+                          date_from=ex_from.isoformat() if ex_from else None, date_to=ex_to.isoformat() if ex_to else None)
+        # הקובץ נכתב לקובץ זמני בדיסק ונמסר לכפתור ההורדה באותה ריצה בלבד — לא נשמר ב-session;
+        # העותק היחיד בזיכרון הוא של כפתור ההורדה, והוא משתחרר בריצה הבאה
+        if st.button("📦 הכנת קובץ"):
+            _, ext, mime = EXPORT_FORMATS[ex_fmt]
+            with tempfile.NamedTemporaryFile(suffix=f".{ext}", delete=False) as tmp:
+                with st.spinner("מכין קובץ…"):
+                    n = write_export(tmp, ex_fmt, **ex_filters)
+            try:
+                with open(tmp.name, "rb") as f:
+                    st.caption(f"{n:,} שורות · {os.path.getsize(tmp.name)/1e6:.1f} MB")
+                    st.download_button("⬇️ הורדה", data=f, file_name=f"food_quality_export.{ext}", mime=mime)
+            finally:
+                os.remove(tmp.name)
+    if st.button("🔄 טעינה מלאה מחדש", help="אחרי שינוי ידני ב-DB (מחיקה/עריכה של רשומות)"):
+        refresh_df(full=True); st.toast("הנתונים נטענו מחדש", icon="🔄")
+    if st.button("🧮 בנייה מחדש של טבלאות הסיכום", help="מחשב מחדש את הסיכומים היומיים מכל הבדיקות"):
+        rebuild_rollups(); refresh_df(full=True); st.toast("טבלאות הסיכום נבנו מחדש", icon="🧮")
+
+    # ייבוא בדיקות היסטוריות (CSV מהגיליון או מהייצוא למעלה)
+    with st.expander("📤 ייבוא בדיקות היסטוריות"):
+        up = st.file_uploader("קובץ CSV", type=["csv"],
+                              help="כותרות כמו בגיליון: תאריך/שעה, סניף, שם טבח, מנה, ציון, הערות")
+        imp_sheets = st.checkbox("להוסיף את השורות גם ל-Google Sheets", value=False,
+                                 help="לא לסמן כשהקובץ הוא ייצוא של הגיליון עצמו")
+        if up is not None and st.button("📤 ייבוא"):
+            bar = st.progress(0.0, text="מייבא…")
+            try:
+                added, rejects = import_records(up, to_sheets=imp_sheets,
+                                                progress=lambda done, total: bar.progress(done / total, text=f"נוספו {done:,} מתוך {total:,}"))
+            except ValueError as e:
+                st.error(f"❌ {e}")
+            else:
+                bar.progress(1.0, text="הסתיים")
+                refresh_df()
+                st.success(f"✅ נוספו {added:,} בדיקות · נדחו {len(rejects):,}")
+                if not rejects.empty:
+                    st.dataframe(rejects["סיבה"].value_counts().rename("שורות"), use_container_width=True)
+                    st.download_button("⬇️ הורדת השורות שנדחו", data=rejects.to_csv(index=False).encode("utf-8-sig"),
+                                       file_name="import_rejects.csv", mime="text/csv")
 
     # PING ל-Sheets ו-GPT
     colx, coly = st.columns(2)
     with colx:
+        worker = sheets_worker()
+        if worker is not None:
+            hs = worker.handle.stats()
+            failed = outbox_failed()
+            st.caption(f"ממתינות לסנכרון ל-Sheets: {outbox_pending()} · נכשלו: {len(failed)} · חיבור שמור: "
+                       f"{hs['hits']} פגיעות / {hs['misses']} פתיחות / {hs['reconnects']} חיבורים מחדש")
+            if not failed.empty:
+                st.dataframe(failed, use_container_width=True, hide_index=True)
+                if st.button("🔁 ניסיון חוזר לשורות שנכשלו"):
+                    st.toast(f"{outbox_retry_failed()} שורות הוחזרו לתור", icon="🔁")
         if st.button("🧪 בדיקת כתיבה ל-Sheets"):
             ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
             ok = save_to_google_sheets("DEBUG","PING","PING",0,"בדיקת מערכת",ts)
             st.success("✅ נכתב לגיליון") if ok else st.error("❌ הכתיבה נכשלה")
     with coly:
-        gc, ge = get_openai_client()
-        if ge: st.info("GPT לא הוגדר")
+        if openai_config_error(): st.info("GPT לא הוגדר")
         else:
             if st.button("🧪 בדיקת GPT"):
                 try:
-                    gc.chat.completions.create(model="gpt-4o-mini",
-                                               messages=[{"role":"user","content":"ping"}],
-                                               temperature=0.0)
+                    gc, ge = get_openai_client()
+                    if ge: raise RuntimeError(ge)
+                    with trace("openai_ping"):
+                        gc.chat.completions.create(model=GPT_MODEL,
+                                                   messages=[{"role":"user","content":"ping"}],
+                                                   temperature=0.0, max_tokens=5,
+                                                   timeout=GPT_PING_TIMEOUT_S)
                     st.success("✅ GPT מחובר")
                 except Exception as e:
                     st.error(f"❌ GPT שגיאה: {e}")
+
+    # זמני ריצה — p50/p95 לכל שלב מתוך המדידות האחרונות בזיכרון
+    with st.expander("⏱️ זמני ריצה"):
+        summary = TRACES.summary()
+        if summary.empty:
+            st.caption("אין מדידות עדיין.")
+        else:
+            budget = budget_report()
+            if not budget.empty:
+                st.markdown("**תקציב זמנים (p95)**")
+                st.dataframe(budget, use_container_width=True)
+            st.dataframe(summary, use_container_width=True)
+            traces = pd.DataFrame(TRACES.snapshot())
+            done = traces.loc[traces["stage"] == "rerun (total)", "run"]
+            if not done.empty:
+                last = traces[traces["run"] == done.iloc[-1]]
+                st.caption(f"ריצה אחרונה שהושלמה: {last['ms'].max():.0f} ms")
+                st.dataframe(last.drop(columns=["run", "ts"]).round(2), use_container_width=True, hide_index=True)
+            st.download_button("⬇️ ייצוא מדידות (JSON)", data=TRACES.to_json().encode("utf-8"),
+                               file_name="timings.json", mime="application/json")
     st.markdown('</div>', unsafe_allow_html=True)
+
+end_run()
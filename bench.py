@@ -0,0 +1,269 @@
+# bench.py — מדידת ביצועים לנתיבים החמים של app2 על DB סינתטי
+# הרצה: python bench.py --sizes 10000 100000 --repeat 20 --json bench.json --md bench.md
+# Sheets ו-OpenAI מוחלפים ב-stubs — נמדדת רק העבודה המקומית (SQLite/pandas).
+
+from __future__ import annotations
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+# "missing ScriptRunContext" / "No runtime found" — צפוי מחוץ ל-streamlit run
+logging.disable(logging.WARNING)
+import quality_core as core  # noqa: E402
+
+SIZES = [10_000, 100_000, 1_000_000, 5_000_000]
+
+FIRST_NAMES = ["לי", "ניו", "ואן", "סון", "חן", "ז'אנג", "דוד", "יוסי", "מוחמד", "אנה", "רון", "מאיה", "עומר", "נועה"]
+LAST_NAMES = ["צ'אנג", "פנג", "לי", "ויי", "דונג", "יאן", "כהן", "לוי", "חדד", "אבו", "פרץ", "מזרחי"]
+NOTES = ["קר מדי", "מלוח", "חסר תיבול", "מרקם מצוין", "מנה לא אחידה", "טמפרטורה טובה", "הגשה יפה",
+         "אורז דביק", "רוטב חסר", "מושלם", "כמות קטנה", "ירקות לא טריים"]
+
+# ---------- נתונים סינתטיים ----------
+def _chefs(rng: np.random.Generator, per_branch: int = 6) -> Dict[str, List[str]]:
+    out, used = {}, set()
+    for b in core.BRANCHES:
+        names = []
+        while len(names) < per_branch:
+            n = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            if n not in used:
+                used.add(n); names.append(n)
+        out[b] = names
+    return out
+
+def synth_rows(n: int, days: int = 3 * 365, seed: int = 7):
+    """מחזיר רשומות (branch, chef, dish, score, notes, created_at) ממוינות לפי זמן.
+
+    סניפים במשקלות שונים, פופולריות מנות בהתפלגות Zipf, טבחים קבועים לכל סניף,
+    ציון = מיומנות טבח + קושי מנה + רעש; שעות סביב צהריים וערב; הערות בעיקר בציונים נמוכים.
+    """
+    rng = np.random.default_rng(seed)
+    branches = np.array(core.BRANCHES, dtype=object)
+    dishes = np.array(core.DISHES, dtype=object)
+    chefs = _chefs(rng)
+    b_w = rng.dirichlet(np.full(len(branches), 5.0))
+    d_w = 1 / np.arange(1, len(dishes) + 1) ** 0.8; d_w /= d_w.sum()
+    skill = {c: rng.normal(7.0, 0.8) for cs in chefs.values() for c in cs}
+    diff = rng.normal(0, 0.5, len(dishes))
+
+    bi = rng.choice(len(branches), n, p=b_w)
+    di = rng.choice(len(dishes), n, p=d_w)
+    ci = rng.integers(0, 6, n)
+    chef = np.array([chefs[branches[b]][c] for b, c in zip(bi, ci)], dtype=object)
+    mu = np.array([skill[c] for c in chef]) + diff[di]
+    score = np.clip(np.rint(mu + rng.normal(0, 1.3, n)), 1, 10).astype(int)
+
+    start = datetime.now(timezone.utc).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days)
+    day = rng.integers(0, days, n)
+    hour = np.where(rng.random(n) < 0.55, rng.normal(12.5, 1.2, n), rng.normal(19.5, 1.5, n)).clip(8, 23.9)
+    secs = day * 86400 + (hour * 3600).astype(int)
+    order = np.argsort(secs, kind="stable")
+    ts = pd.to_datetime(start) + pd.to_timedelta(secs[order], unit="s")
+    created = ts.strftime("%Y-%m-%d %H:%M:%S")
+
+    has_note = rng.random(n) < np.where(score <= 4, 0.6, 0.15)
+    note = np.where(has_note, rng.choice(NOTES, n), "")
+    return zip(branches[bi][order], chef[order], dishes[di][order], score[order].tolist(), note[order], created)
+
+def seed_db(path: str, n: int, days: int = 3 * 365, seed: int = 7, chunk: int = 100_000):
+    """יוצר DB בגודל n. הטריגרים של טבלאות הסיכום מושבתים בזמן הטעינה ונבנים מחדש בסוף."""
+    core.DB_PATH = path
+    core.db_pool.clear()
+    core.init_db()
+    rows = synth_rows(n, days, seed)
+    with core.db_write() as c:
+        c.execute("BEGIN IMMEDIATE")  # גם ה-DROP בתוך הטרנזקציה — כשל באמצע לא משאיר DB בלי טריגרים
+        for t in ("ins", "del", "upd"):
+            c.execute(f"DROP TRIGGER IF EXISTS trg_rollup_{t}")
+        while True:
+            batch = [r for _, r in zip(range(chunk), rows)]
+            if not batch: break
+            c.executemany("""INSERT INTO food_quality (branch, chef_name, dish_name, score, notes, created_at)
+                             VALUES (?, ?, ?, ?, ?, ?)""", batch)
+        core.rebuild_rollups(c)
+        for q in core._rollup_ddl(): c.execute(q)
+
+# ---------- stubs ----------
+class _FakeWorksheet:
+    def __init__(self): self.rows = 0
+    def append_row(self, row, value_input_option=None): self.rows += 1
+    def append_rows(self, rows, value_input_option=None): self.rows += len(rows)
+
+class FakeGspreadClient:
+    def __init__(self): self._ws = _FakeWorksheet()
+    def open_by_url(self, url): return self
+    def open_by_key(self, key): return self
+    def open(self, title): return self
+    def worksheet(self, name): return self._ws
+
+class FakeOpenAI:
+    """מחקה chat.completions.create(stream=True) בלי רשת"""
+    def __init__(self, answer: str = "תשובה לדוגמה " * 40):
+        words = answer.split(" ")
+        def create(**kw):
+            def chunk(w):
+                return types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=w + " "))])
+            return iter([chunk(w) for w in words])
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=create))
+
+# ---------- מדידה ----------
+def measure(fn: Callable[[int], object], repeat: int, warmup: int = 1) -> dict:
+    for i in range(warmup):
+        fn(-1 - i)
+    times = []
+    tracemalloc.start()
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        fn(i)
+        times.append((time.perf_counter() - t0) * 1000)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    a = np.array(times)
+    return {"runs": repeat, "mean_ms": a.mean(), "p50_ms": np.percentile(a, 50), "p95_ms": np.percentile(a, 95),
+            "p99_ms": np.percentile(a, 99), "max_ms": a.max(), "peak_mem_mb": peak / 2**20}
+
+def hot_paths(rng: random.Random) -> Dict[str, Callable[[int], object]]:
+    chefs = [r[0] for r in sqlite3.connect(core.DB_PATH).execute("SELECT DISTINCT chef_name FROM food_quality")]
+    pick = lambda: (rng.choice(core.BRANCHES), rng.choice(chefs), rng.choice(core.DISHES))
+    worker = core.SheetsOutboxWorker(core.SheetsHandle(FakeGspreadClient, "bench", "sheet1"), pool=core.db_pool())
+    core.sheets_worker = lambda: worker  # insert_record כותב לתור; בלי thread ובלי רשת
+    gpt = FakeOpenAI()
+
+    def trends_incremental(i):
+        core.insert_record(*pick(), rng.randint(1, 10), "")
+        return core.load_trends("chef_dish")
+    def kpis(i):
+        core.load_kpis.clear()
+        k = core.load_kpis(core.MIN_BRANCH_LEADER_N, core.MIN_CHEF_TOP_M)
+        return (core.kpi_best_branch_by_count(k), core.kpi_best_avg_branch(k, core.MIN_BRANCH_LEADER_N),
+                core.kpi_top_chef(k, core.MIN_CHEF_TOP_M), core.kpi_top_dish(k))
+    def duplicate(i):
+        return core.has_recent_duplicate(*pick())
+    def insert(i):
+        core.insert_record(*pick(), rng.randint(1, 10), "בדיקת ביצועים")
+    def outbox_drain(i):
+        return worker.drain_once()
+    def llm_digest(i):
+        with core.db_read() as c:
+            return core.build_llm_digest(c)
+    def gpt_answer(i):
+        it, _ = core.cached_answer_stream(gpt, "bench", "prompt", question=f"q{i}", version=core.data_version())
+        return "".join(it)
+
+    core.load_trends("chef_dish")  # בנייה ראשונה מטבלאות הסיכום — לא חלק מהמדידה
+    return {"insert + load_trends (incremental)": trends_incremental, "kpi_* (load_kpis)": kpis, "has_recent_duplicate": duplicate, "insert_record": insert,
+            "outbox drain (fake Sheets)": outbox_drain, "build_llm_digest": llm_digest,
+            "GPT answer (fake client, cache miss)": gpt_answer}
+
+# ---------- עלייה וריצות חוזרות של app2 ----------
+# תהליך נפרד לכל מדידה (קר באמת): streamlit נטען קודם, כמו בשרת; app2 רץ ב-AppTest כמשתמש מטה.
+STARTUP_SCRIPT = r"""
+import json, logging, sys, time
+logging.disable(logging.WARNING)
+from streamlit.testing.v1 import AppTest
+t = time.perf_counter(); import quality_core; imp = time.perf_counter() - t
+at = AppTest.from_file(sys.argv[1], default_timeout=300)
+at.secrets["OPENAI_API_KEY"] = "sk-bench"
+at.session_state["auth"] = {"role": "meta", "branch": None}
+t = time.perf_counter(); at.run(); first = time.perf_counter() - t
+warm = []
+for _ in range(int(sys.argv[2])):
+    t = time.perf_counter(); at.run(); warm.append(time.perf_counter() - t)
+print(json.dumps({"import": imp * 1000, "first": first * 1000, "warm": [w * 1000 for w in warm],
+                  "errors": len(at.exception),
+                  "sdks": [m for m in ("gspread", "openai") if m in sys.modules]}))
+"""
+
+def startup(path: str, repeat: int, procs: int = 3) -> Dict[str, dict]:
+    """זמן import של quality_core, ריצה ראשונה וריצות חוזרות של app2 — מול התקציבים ב-quality_core"""
+    app = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app2.py")
+    env = {**os.environ, "FOOD_QUALITY_DB": path}
+    runs = []
+    for _ in range(procs):
+        # cwd = תיקיית הריפו, כדי ש-import quality_core יעבוד גם כשמריצים את bench.py ממקום אחר
+        out = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, app, str(repeat)], env=env, cwd=os.path.dirname(app),
+                             capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+    if any(r["errors"] for r in runs):
+        raise RuntimeError("app2 raised during the startup benchmark")
+    print(f"SDKs loaded by the first app run: {', '.join(runs[0]['sdks']) or 'none'}", flush=True)
+    stat = lambda xs: {"runs": len(xs), "mean_ms": np.mean(xs), "p50_ms": np.percentile(xs, 50),
+                       "p95_ms": np.percentile(xs, 95), "p99_ms": np.percentile(xs, 99), "max_ms": max(xs)}
+    return {"startup: import quality_core": stat([r["import"] for r in runs]),
+            f"startup: first app run (budget {core.STARTUP_BUDGET_MS}ms)": stat([r["first"] for r in runs]),
+            f"app rerun (budget {core.RERUN_BUDGET_MS}ms)": stat([w for r in runs for w in r["warm"]])}
+
+def run(sizes: List[int], repeat: int, days: int, seed: int, workdir: str) -> dict:
+    results = []
+    for n in sizes:
+        path = os.path.join(workdir, f"bench_{n}.db")
+        if os.path.exists(path): os.remove(path)
+        t0 = time.perf_counter()
+        seed_db(path, n, days, seed)
+        seed_s = time.perf_counter() - t0
+        print(f"[{n:,}] seeded in {seed_s:.1f}s", flush=True)
+        for name, fn in hot_paths(random.Random(seed)).items():
+            r = measure(fn, repeat)
+            results.append({"size": n, "path": name, "runs": r.pop("runs"), **{k: round(float(v), 3) for k, v in r.items()}})
+            print(f"[{n:,}] {name}: p50={r['p50_ms']:.2f}ms p95={r['p95_ms']:.2f}ms peak={r['peak_mem_mb']:.1f}MB", flush=True)
+        for name, r in startup(path, repeat).items():
+            results.append({"size": n, "path": name, "runs": r.pop("runs"), **{k: round(float(v), 3) for k, v in r.items()}})
+            print(f"[{n:,}] {name}: p50={r['p50_ms']:.2f}ms p95={r['p95_ms']:.2f}ms", flush=True)
+        results.append({"size": n, "path": "seed_db", "runs": 1, "mean_ms": round(seed_s * 1000, 1)})
+    return {
+        "meta": {"created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"), "repeat": repeat,
+                 "days": days, "seed": seed, "python": platform.python_version(), "pandas": pd.__version__,
+                 "sqlite": sqlite3.sqlite_version, "platform": platform.platform()},
+        "results": results,
+    }
+
+def to_markdown(report: dict) -> str:
+    cols = ["size", "path", "runs", "p50_ms", "p95_ms", "p99_ms", "max_ms", "peak_mem_mb"]
+    lines = [f"# Benchmark — {report['meta']['created_at']}", "",
+             "| " + " | ".join(cols) + " |", "|" + "---|" * len(cols)]
+    for r in report["results"]:
+        if r["path"] == "seed_db": continue
+        lines.append("| " + " | ".join(f"{r[c]:,}" if c == "size" else str(r.get(c, "")) for c in cols) + " |")
+    return "\n".join(lines) + "\n"
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark the app's hot paths on a synthetic food_quality DB")
+    ap.add_argument("--sizes", type=int, nargs="+", default=SIZES[:2], help="row counts (10k–5M)")
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--days", type=int, default=3 * 365, help="history span of the synthetic data")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--workdir", help="where to keep the seeded DBs (default: temp dir, removed afterwards)")
+    ap.add_argument("--json", dest="json_path", help="write the JSON report here")
+    ap.add_argument("--md", dest="md_path", help="write the markdown report here")
+    args = ap.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="giraffe-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        report = run(args.sizes, args.repeat, args.days, args.seed, workdir)
+    finally:
+        if not args.workdir: shutil.rmtree(workdir, ignore_errors=True)
+    md = to_markdown(report)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f: json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.md_path:
+        with open(args.md_path, "w", encoding="utf-8") as f: f.write(md)
+    print(md)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1303 @@
+# quality_core.py — שכבת הנתונים של app2.py: SQLite, Google Sheets, GPT ומדדים (בלי רכיבי UI)
+# מופרד מ-app2.py כדי שאפשר יהיה לייבא אותו מחוץ ל-streamlit run (למשל bench.py)
+
+from __future__ import annotations
+import os
+import sqlite3
+import gzip
+import hashlib
+import io
+import json
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import count
+from datetime import datetime, timedelta, timezone
+from typing import Any, BinaryIO, Callable, Dict, Iterator, Optional, Tuple, List
+
+_IMPORT_T0 = time.perf_counter()  # זמן טעינת המודול (נרשם ב-TRACES בסוף הקובץ)
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# ---------- קבועים ----------
+BRANCHES: List[str] = ["חיפה","ראשל״צ","רמה״ח","נס ציונה","לנדמרק","פתח תקווה","הרצליה","סביון"]
+DISHES:   List[str] = ["פאד תאי","מלאזית","פיליפינית","אפגנית","קארי דלעת","סצ'ואן","ביף רייס","אורז מטוגן",
+                       "מאקי סלמון","מאקי טונה","ספייסי סלמון","נודלס ילדים"]
+DB_PATH = os.environ.get("FOOD_QUALITY_DB", "food_quality.db")
+DUP_HOURS = 12
+MIN_BRANCH_LEADER_N = 3
+MIN_CHEF_TOP_M = 5
+GPT_TOKEN_BUDGET = 3000  # תקרת גודל התקציר שנשלח ל-GPT (הערכה גסה בטוקנים)
+TREND_DAYS = 28          # חלון "אחרון" להשוואת מגמה
+TREND_HALFLIFE_WEEKS = 4   # זמן מחצית למגמה המשוקללת (EWM)
+ANOMALY_Z = 2.5            # סף z לחריגה בכרטיס המגמות
+ANOMALY_MIN_N = 3          # מינימום בדיקות בחלון האחרון כדי לסמן חריגה
+ANOMALY_BASELINE_MIN_N = 10  # מינימום בדיקות לפני החלון (בסיס ההשוואה)
+GPT_MODEL = "gpt-4o-mini"
+GPT_CACHE_TTL_HOURS = 24   # תוקף תשובה שמורה
+GPT_CACHE_MAX_ROWS = 500   # מעבר לזה — מוחקים את הפחות-בשימוש
+GPT_TIMEOUT_S = 60         # זמן מקסימלי לבקשת ניתוח (שניות)
+GPT_PING_TIMEOUT_S = 10    # זמן מקסימלי לבדיקת חיבור
+TRACE_BUFFER_SIZE = 5000   # כמה מדידות אחרונות נשמרות בזיכרון
+HISTORY_PAGE_SIZE = 50     # שורות בעמוד בדפדפן ההיסטוריה
+IMPORT_CHUNK = 50_000      # שורות ל-executemany בייבוא (כולן באותה טרנזקציה)
+IMPORT_CACHE_KB = 256 * 1024  # מטמון דפים של SQLite בזמן ייבוא
+EXPORT_CHUNK = 20_000      # שורות לכל קריאה מה-cursor בייצוא
+STARTUP_BUDGET_MS = 1000   # תקציב לריצה הראשונה בתהליך (כולל יצירת DB, pool ומטמונים)
+RERUN_BUDGET_MS = 150      # תקציב לכל ריצה חוזרת (אינטראקציה)
+OUTBOX_MAX_ATTEMPTS = 20   # אחרי זה שורה בתור נעצרת ("נכשלה") עד ניסיון חוזר ידני (~שעה וחצי עם backoff)
+OUTBOX_KEEP_SYNCED_HOURS = 24  # שורות שסונכרנו נמחקות מהתור אחרי זמן זה
+
+# ---------- מדידת זמנים ----------
+# כל מדידה: {stage, run, ts, ms, ...} — run מזהה ריצת סקריפט (rerun), None = thread ברקע.
+# trace() פותח מדידה; trace_note() מוסיף שדות (rows, cache_hit...) למדידה הפתוחה הפנימית.
+class TraceBuffer:
+    """חוצץ מעגלי, thread-safe, של מדידות אחרונות"""
+
+    def __init__(self, maxlen: int = TRACE_BUFFER_SIZE):
+        self._items: deque = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def add(self, rec: Dict[str, Any]):
+        with self._lock:
+            self._items.append(rec)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._items)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def summary(self) -> pd.DataFrame:
+        """p50/p95 לכל שלב, ממוצע שורות ושיעור פגיעות במטמון"""
+        df = pd.DataFrame(self.snapshot())
+        if df.empty:
+            return df
+        for col in ("rows", "cache_hit"):
+            df[col] = df[col].astype("float") if col in df else float("nan")
+        g = df.groupby("stage").agg(
+            n=("ms", "size"), p50_ms=("ms", "median"), p95_ms=("ms", lambda x: x.quantile(0.95)),
+            max_ms=("ms", "max"), rows=("rows", "mean"), cache_hit_rate=("cache_hit", "mean"),
+        )
+        return g.sort_values("p95_ms", ascending=False).round(2)
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), ensure_ascii=False, default=str)
+
+TRACES = TraceBuffer()
+_trace_local = threading.local()
+_run_ids = count(1)
+
+def begin_run() -> int:
+    """לקרוא בתחילת כל ריצת סקריפט — מדידות בהמשך הריצה משויכות אליה"""
+    _trace_local.run = next(_run_ids)
+    _trace_local.run_t0 = time.perf_counter()
+    return _trace_local.run
+
+_first_run_done = threading.Event()
+
+def end_run():
+    """לקרוא בסוף הסקריפט; ריצות שנקטעו (st.stop/st.rerun) לא נרשמות כסה"כ.
+    הריצה הראשונה בתהליך נמדדת מול STARTUP_BUDGET_MS, השאר מול RERUN_BUDGET_MS."""
+    t0 = getattr(_trace_local, "run_t0", None)
+    if t0 is not None:
+        first = not _first_run_done.is_set()
+        _first_run_done.set()
+        ms = (time.perf_counter() - t0) * 1000
+        budget = STARTUP_BUDGET_MS if first else RERUN_BUDGET_MS
+        TRACES.add({"stage": "rerun (first)" if first else "rerun (total)", "run": _trace_local.run,
+                    "ts": time.time(), "ms": ms, "over_budget": ms > budget})
+        _trace_local.run_t0 = None
+
+def budget_report() -> pd.DataFrame:
+    """p50/p95 של זמן הטעינה (import), הריצה הראשונה והריצות החוזרות מול התקציב"""
+    s = TRACES.summary()
+    rows = [(stage, budget) for stage, budget in (("import quality_core", None),
+                                                  ("rerun (first)", STARTUP_BUDGET_MS),
+                                                  ("rerun (total)", RERUN_BUDGET_MS)) if stage in s.index]
+    out = pd.DataFrame([{"stage": st_, "n": s.at[st_, "n"], "p50_ms": s.at[st_, "p50_ms"], "p95_ms": s.at[st_, "p95_ms"],
+                         "budget_ms": b, "ok": None if b is None else bool(s.at[st_, "p95_ms"] <= b)}
+                        for st_, b in rows])
+    return out.set_index("stage") if not out.empty else out
+
+@contextmanager
+def trace(stage: str, **fields):
+    rec = {"stage": stage, "run": getattr(_trace_local, "run", None), "ts": time.time(), **fields}
+    stack = _trace_local.__dict__.setdefault("stack", [])
+    stack.append(rec)
+    t0 = time.perf_counter()
+    try:
+        yield rec
+    except BaseException as e:
+        rec["error"] = type(e).__name__
+        raise
+    finally:
+        rec["ms"] = (time.perf_counter() - t0) * 1000
+        stack.pop()
+        TRACES.add(rec)
+
+def trace_note(**fields):
+    """מעדכן את המדידה הפתוחה הפנימית (אם יש)"""
+    stack = getattr(_trace_local, "stack", None)
+    if stack:
+        stack[-1].update(fields)
+
+def timed(stage: str, rows: Optional[Callable[[Any], int]] = None):
+    """דקורטור: מודד כל קריאה; rows(result) — מספר שורות לתיעוד"""
+    def deco(fn):
+        def wrapper(*args, **kwargs):
+            with trace(stage) as rec:
+                out = fn(*args, **kwargs)
+                if rows is not None: rec["rows"] = rows(out)
+                return out
+        wrapper.__name__, wrapper.__doc__, wrapper.__wrapped__ = fn.__name__, fn.__doc__, fn
+        return wrapper
+    return deco
+
+# ---------- DB ----------
+# WAL: קוראים לא חוסמים את הכותב (ולהפך); NORMAL בטוח ב-WAL וחוסך fsync בכל commit
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA mmap_size=268435456",
+]
+
+def conn(path: str = DB_PATH) -> sqlite3.Connection:
+    """חיבור חדש ומכוונן — בשימוש דרך ConnectionPool"""
+    c = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+    for q in PRAGMAS: c.execute(q)
+    return c
+
+class ConnectionPool:
+    """חיבורי קריאה ממוחזרים (query_only) + חיבור כתיבה יחיד מאחורי מנעול.
+
+    read(): חיבור לקריאה בלבד; עד max_readers במקביל.
+    write(): החיבור הכותב; commit ביציאה תקינה, rollback בחריגה.
+    """
+
+    def __init__(self, path: str = DB_PATH, max_readers: int = 8):
+        self.path = path
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_readers)
+        self._writer: Optional[sqlite3.Connection] = None
+        self._write_lock = threading.Lock()
+
+    @contextmanager
+    def read(self):
+        with self._slots:
+            try:
+                c = self._idle.get_nowait()
+            except queue.Empty:
+                c = conn(self.path); c.execute("PRAGMA query_only=1")
+            try:
+                yield c
+            finally:
+                self._idle.put(c)
+
+    @contextmanager
+    def write(self):
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = conn(self.path)
+            try:
+                yield self._writer
+                self._writer.commit()
+            except BaseException:
+                self._writer.rollback()
+                raise
+
+@st.cache_resource
+def db_pool() -> ConnectionPool:
+    return ConnectionPool(DB_PATH)
+
+def db_read():
+    return db_pool().read()
+
+def db_write():
+    return db_pool().write()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS food_quality (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  branch TEXT NOT NULL,
+  chef_name TEXT NOT NULL,
+  dish_name TEXT NOT NULL,
+  score INTEGER NOT NULL CHECK(score BETWEEN 1 AND 10),
+  notes TEXT,
+  created_at TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP),
+  submitted_by TEXT
+);
+"""
+# תור יוצא ל-Google Sheets — נכתב באותה טרנזקציה כמו הבדיקה ומרוקן ע"י worker ברקע
+OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sheets_outbox (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  record_id INTEGER,
+  created_at TEXT NOT NULL,
+  branch TEXT NOT NULL,
+  chef_name TEXT NOT NULL,
+  dish_name TEXT NOT NULL,
+  score INTEGER NOT NULL,
+  notes TEXT,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt_at REAL NOT NULL DEFAULT 0,
+  last_error TEXT,
+  synced_at TEXT
+);
+"""
+# מטמון תשובות GPT — מפתח: hash של מודל, הנחיית מערכת, שאלה מנורמלת וגרסת נתונים
+GPT_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS gpt_cache (
+  key TEXT PRIMARY KEY,
+  model TEXT NOT NULL,
+  question TEXT NOT NULL,
+  data_version TEXT NOT NULL,
+  answer TEXT NOT NULL,
+  created_at REAL NOT NULL,
+  last_hit_at REAL NOT NULL,
+  hits INTEGER NOT NULL DEFAULT 0
+);
+"""
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_food_branch_time ON food_quality(branch, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_food_chef_dish_time ON food_quality(chef_name, dish_name, created_at)",
+    # דפדוף היסטוריה: לכל סינון שוויון — אינדקס שנגמר ב-created_at (ה-id מובלע בסוף כל אינדקס)
+    "CREATE INDEX IF NOT EXISTS idx_food_time ON food_quality(created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_food_chef_time ON food_quality(chef_name, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_food_dish_time ON food_quality(dish_name, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON sheets_outbox(next_attempt_at) WHERE synced_at IS NULL",
+    "CREATE INDEX IF NOT EXISTS idx_outbox_synced ON sheets_outbox(synced_at) WHERE synced_at IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_gpt_cache_lru ON gpt_cache(last_hit_at)",
+]
+
+# ---------- טבלאות סיכום יומיות ----------
+# לכל זוג ממדים: (יום, מפתח1, מפתח2) -> n, sum(score), sum(score²) — מספיק לממוצע וסטיית תקן.
+# מתוחזקות ע"י טריגרים (באותה טרנזקציה של ה-INSERT/DELETE/UPDATE), וניתנות לבנייה מחדש.
+ROLLUPS = {
+    "branch_dish": ("branch", "dish_name"),
+    "branch_chef": ("branch", "chef_name"),
+    "chef_dish":   ("chef_name", "dish_name"),
+}
+
+def _rollup_ddl() -> List[str]:
+    ddl, ins, dele = [], [], []
+    for kind, (k1, k2) in ROLLUPS.items():
+        t = f"rollup_{kind}"
+        ddl.append(f"""CREATE TABLE IF NOT EXISTS {t} (
+  day TEXT NOT NULL, {k1} TEXT NOT NULL, {k2} TEXT NOT NULL,
+  n INTEGER NOT NULL, s INTEGER NOT NULL, ss INTEGER NOT NULL,
+  PRIMARY KEY (day, {k1}, {k2})
+) WITHOUT ROWID""")
+        ins.append(f"""INSERT INTO {t} (day, {k1}, {k2}, n, s, ss)
+    VALUES (substr(NEW.created_at, 1, 10), NEW.{k1}, NEW.{k2}, 1, NEW.score, NEW.score * NEW.score)
+    ON CONFLICT (day, {k1}, {k2}) DO UPDATE SET n = n + 1, s = s + excluded.s, ss = ss + excluded.ss;""")
+        key = f"day = substr(OLD.created_at, 1, 10) AND {k1} = OLD.{k1} AND {k2} = OLD.{k2}"
+        dele.append(f"""UPDATE {t} SET n = n - 1, s = s - OLD.score, ss = ss - OLD.score * OLD.score WHERE {key};
+  DELETE FROM {t} WHERE {key} AND n <= 0;""")
+    ins, dele = "\n  ".join(ins), "\n  ".join(dele)
+    ddl += [
+        f"CREATE TRIGGER IF NOT EXISTS trg_rollup_ins AFTER INSERT ON food_quality BEGIN\n  {ins}\nEND",
+        f"CREATE TRIGGER IF NOT EXISTS trg_rollup_del AFTER DELETE ON food_quality BEGIN\n  {dele}\nEND",
+        "CREATE TRIGGER IF NOT EXISTS trg_rollup_upd AFTER UPDATE OF branch, chef_name, dish_name, score, created_at "
+        f"ON food_quality BEGIN\n  {dele}\n  {ins}\nEND",
+    ]
+    return ddl
+
+def rebuild_rollups(c: Optional[sqlite3.Connection] = None):
+    """בונה מחדש את כל טבלאות הסיכום מ-food_quality (פקודת מנהל)"""
+    if c is None:
+        with db_write() as c:
+            return rebuild_rollups(c)
+    for kind, (k1, k2) in ROLLUPS.items():
+        t = f"rollup_{kind}"
+        c.execute(f"DELETE FROM {t}")
+        c.execute(f"""INSERT INTO {t} (day, {k1}, {k2}, n, s, ss)
+                      SELECT substr(created_at, 1, 10), {k1}, {k2}, COUNT(*), SUM(score), SUM(score * score)
+                      FROM food_quality GROUP BY 1, 2, 3""")
+
+def init_db():
+    with db_write() as c:
+        c.execute(SCHEMA)
+        c.execute(OUTBOX_SCHEMA)
+        c.execute(GPT_CACHE_SCHEMA)
+        for q in INDEXES: c.execute(q)
+        for q in _rollup_ddl(): c.execute(q)
+        # DB קיים מלפני טבלאות הסיכום — מילוי ראשוני
+        if c.execute("SELECT EXISTS(SELECT 1 FROM food_quality) AND NOT EXISTS(SELECT 1 FROM rollup_branch_dish)").fetchone()[0]:
+            rebuild_rollups(c)
+
+@st.cache_resource(show_spinner=False)
+def ensure_db() -> bool:
+    """init_db פעם אחת לתהליך — ה-DDL לא רץ שוב בכל rerun"""
+    with trace("init_db"):
+        init_db()
+    return True
+
+# ---------- רענון אחרי כתיבה ----------
+# כל המסכים קוראים ב-SQL (מדדים ומגמות מטבלאות הסיכום, היסטוריה וייצוא דרך האינדקסים) —
+# אין פריים משותף של כל הבדיקות; מה שנשמר בזיכרון הוא תוצאת load_kpis ומאגר המגמות.
+DF_COLUMNS = "id, branch, chef_name, dish_name, score, notes, created_at"  # ייצוא
+
+def refresh_df(full:bool=False):
+    """אחרי הוספה המגמות מתעדכנות לבד (רק id חדשים); full=True אחרי פעולה שמשנה היסטוריה
+    או את טבלאות הסיכום (המגמות נבנות מהן)"""
+    if full:
+        trends = _trend_store()
+        with trends["lock"]:
+            trends["weekly"].clear(); trends["last_id"] = 0
+    load_kpis.clear()
+
+# ---------- שכבת Secrets: Sheets ----------
+# gspread + google-auth (~100ms ייבוא) נטענות רק בשימוש הראשון ב-Sheets, לא בעליית התהליך
+@lru_cache(maxsize=None)
+def _gsheets():
+    """(gspread, Credentials), או None אם הספריות לא מותקנות"""
+    try:
+        import gspread
+        from google.oauth2.service_account import Credentials
+    except Exception:
+        return None
+    return gspread, Credentials
+
+def gsheets_available() -> bool:
+    return _gsheets() is not None
+
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets",
+          "https://www.googleapis.com/auth/drive"]
+
+def _normalize_private_key(creds: dict) -> dict:
+    """מתקן את ה-private key - מחליף \\n ב-\n אם נדרש"""
+    pk = creds.get("private_key")
+    if isinstance(pk, str) and "\\n" in pk:
+        creds = creds.copy()
+        creds["private_key"] = pk.replace("\\n", "\n")
+    return creds
+
+@timed("sheets_config")
+def _get_sheets_config():
+    """מחזיר את הגדרות החיבור לגוגל שיטס"""
+    try:
+        sheet_url = st.secrets.get("GOOGLE_SHEET_URL")
+        sheet_id = st.secrets.get("GOOGLE_SHEET_ID")
+        sheet_title = st.secrets.get("GOOGLE_SHEET_TITLE")
+        ws_name = st.secrets.get("GOOGLE_SHEET_WORKSHEET", "sheet1")
+
+        # נסה לקבל את ה-service account credentials
+        creds_dict = dict(st.secrets.get("google_service_account", {}))
+        
+        if not creds_dict:
+            return None, None, ws_name
+            
+        # תקן את ה-private key
+        creds_dict = _normalize_private_key(creds_dict)
+        
+        # וודא שיש את כל השדות הנדרשים
+        required_fields = ["type", "project_id", "private_key", "client_email", "client_id", "token_uri"]
+        missing_fields = [field for field in required_fields if field not in creds_dict]
+        
+        if missing_fields:
+            st.error(f"חסרים שדות ב-google_service_account: {', '.join(missing_fields)}")
+            return None, None, ws_name
+
+        identifier = sheet_url or sheet_id or sheet_title
+        return creds_dict, identifier, ws_name
+        
+    except Exception as e:
+        st.error(f"שגיאה בקריאת הגדרות Sheets: {e}")
+        return None, None, "sheet1"
+
+def _open_spreadsheet(gc, identifier: str):
+    """פותח את הגיליון לפי מזהה - URL, ID או כותרת"""
+    if identifier.startswith("http"):
+        return gc.open_by_url(identifier)
+    if "/" not in identifier and " " not in identifier:
+        try:
+            return gc.open_by_key(identifier)
+        except Exception:
+            pass
+    return gc.open(identifier)
+
+SHEET_HEADERS = ["תאריך/שעה", "סניף", "שם טבח", "מנה", "ציון", "הערות"]
+
+def _authorize(creds_dict: dict):
+    """יוצר gspread client מאומת"""
+    gspread, Credentials = _gsheets()
+    credentials = Credentials.from_service_account_info(creds_dict, scopes=SCOPES)
+    return gspread.authorize(credentials)
+
+def _resolve_worksheet(gc, identifier: str, ws_name: str):
+    """פותח את ה-worksheet, ויוצר אותו (עם כותרות) אם אינו קיים"""
+    sh = _open_spreadsheet(gc, identifier)
+    try:
+        return sh.worksheet(ws_name)
+    except Exception:
+        ws = sh.add_worksheet(title=ws_name, rows=1000, cols=12)
+        ws.append_row(SHEET_HEADERS)
+        return ws
+
+# ---------- Sheets: client/worksheet משותפים ----------
+def _needs_reconnect(e: Exception) -> bool:
+    """שגיאות אימות/404 — ה-handle השמור כבר לא תקף"""
+    status = getattr(getattr(e, "response", None), "status_code", None)
+    return status in (401, 403, 404) or type(e).__name__ in (
+        "RefreshError", "SpreadsheetNotFound", "WorksheetNotFound")
+
+class SheetsHandle:
+    """מחזיק client מאומת + worksheet פתוח לשימוש חוזר בין כתיבות.
+
+    make_client: פונקציה שמחזירה gspread client (או מזויף לבדיקות).
+    call(fn) מריץ fn(ws); בשגיאת אימות/404 — מתחבר מחדש ומנסה פעם אחת נוספת.
+    """
+
+    def __init__(self, make_client, identifier: str, ws_name: str):
+        self.make_client = make_client
+        self.identifier = identifier
+        self.ws_name = ws_name
+        self._ws = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+
+    def worksheet(self):
+        with self._lock:
+            trace_note(cache_hit=self._ws is not None)
+            if self._ws is not None:
+                self.hits += 1
+                return self._ws
+            self.misses += 1
+            self._ws = _resolve_worksheet(self.make_client(), self.identifier, self.ws_name)
+            return self._ws
+
+    def invalidate(self):
+        with self._lock:
+            self._ws = None
+
+    def call(self, fn):
+        try:
+            return fn(self.worksheet())
+        except Exception as e:
+            if not _needs_reconnect(e):
+                raise
+            self.invalidate()
+            self.reconnects += 1
+            return fn(self.worksheet())
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "reconnects": self.reconnects}
+
+def _sheets_client(creds_dict: dict):
+    """client חדש עם ה-credentials העדכניים מ-secrets — מפתח שהוחלף (גם לאותו client_email)
+    נקלט בחיבור מחדש בלי restart; אם ההגדרות נעלמו — אלה שה-handle נוצר איתם"""
+    fresh, _, _ = _get_sheets_config()
+    return _authorize(fresh or creds_dict)
+
+def _creds_fingerprint(creds_dict: dict) -> str:
+    return hashlib.sha256(json.dumps(creds_dict, sort_keys=True).encode()).hexdigest()
+
+@st.cache_resource
+def _sheets_handle(identifier: str, ws_name: str, creds_fingerprint: str, _creds_dict: dict) -> SheetsHandle:
+    return SheetsHandle(lambda: _sheets_client(_creds_dict), identifier, ws_name)
+
+def get_sheets_handle() -> Optional[SheetsHandle]:
+    """handle יחיד לתהליך (לכל הגדרה — כולל המפתח עצמו); None אם Sheets לא מוגדר — בלי הודעות למשתמש"""
+    creds_dict, identifier, ws_name = _get_sheets_config()
+    if not (creds_dict and identifier) or not gsheets_available():
+        return None
+    return _sheets_handle(identifier, ws_name, _creds_fingerprint(creds_dict), creds_dict)
+
+def save_to_google_sheets(branch: str, chef: str, dish: str, score: int, notes: str, ts: str) -> bool:
+    """שומר רשומה לגוגל שיטס (סינכרוני — לבדיקת מערכת; שמירות רגילות עוברות דרך התור)"""
+    if not gsheets_available():
+        st.warning("gspread/google-auth לא מותקנות — לא ניתן לכתוב לגיליון.")
+        return False
+        
+    creds_dict, identifier, ws_name = _get_sheets_config()
+    
+    if not creds_dict:
+        st.warning("חסרות הגדרות google_service_account ב-secrets.toml")
+        return False
+        
+    if not identifier:
+        st.warning("חסר מזהה גיליון (GOOGLE_SHEET_URL/ID/TITLE) ב-secrets.toml")
+        return False
+        
+    try:
+        with trace("sheets_append", rows=1):
+            _sheets_handle(identifier, ws_name, _creds_fingerprint(creds_dict), creds_dict).call(
+                lambda ws: ws.append_row([ts, branch, chef, dish, score, notes or ""], value_input_option="USER_ENTERED"))
+        return True
+        
+    except Exception as e:
+        st.error(f"שגיאת Google Sheets: {e}")
+        return False
+
+# ---------- Sheets: תור יוצא + worker ברקע ----------
+class SheetsOutboxWorker:
+    """מרוקן את sheets_outbox ל-Google Sheets ב-append_rows במנות.
+
+    handle: SheetsHandle משותף (client/worksheet נשמרים בין מנות).
+    pool: ConnectionPool (ברירת מחדל db_pool()).
+    כתיבה "לפחות פעם אחת": אם הסימון נכשל אחרי append — השורה עלולה להיכתב שוב.
+    כשל: backoff מעריכי, והמנה הבאה של אותן שורות קטנה בחצי בכל ניסיון — שורה שנדחית תמיד
+    מבודדת לבד ונעצרת אחרי max_attempts, בלי לעכב את השאר. שורות שסונכרנו נמחקות אחרי keep_synced_hours.
+    """
+
+    def __init__(self, handle: SheetsHandle, pool: Optional[ConnectionPool] = None,
+                 batch_size: int = 200, poll_interval: float = 5.0,
+                 base_backoff: float = 2.0, max_backoff: float = 300.0,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS, keep_synced_hours: float = OUTBOX_KEEP_SYNCED_HOURS):
+        self.handle = handle
+        self.pool = pool or db_pool()
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.keep_synced_hours = keep_synced_hours
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "SheetsOutboxWorker":
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sheets-outbox", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set(); self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def wake(self):
+        """מעיר את ה-worker מיד (אחרי שמירה)"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                n = self.drain_once()
+            except Exception:
+                n = 0
+            if n < self.batch_size:  # התור ריק/ממתין ל-backoff — נחכה להתעוררות או לפולינג
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def drain_once(self) -> int:
+        """שולח מנה אחת מהתור; מחזיר כמה שורות סונכרנו"""
+        now = time.time()
+        with self.pool.read() as c:
+            rows = c.execute(
+                """SELECT id, created_at, branch, chef_name, dish_name, score, notes, attempts FROM sheets_outbox
+                   WHERE synced_at IS NULL AND next_attempt_at <= ? AND attempts < ? ORDER BY id LIMIT ?""",
+                (now, self.max_attempts, self.batch_size),
+            ).fetchall()
+        if not rows:
+            return 0
+        rows = rows[:max(1, self.batch_size >> rows[0][7])]  # חצי מנה לכל כשל קודם של השורה הראשונה
+        values = [[r[1], r[2], r[3], r[4], r[5], r[6] or ""] for r in rows]
+        try:
+            with trace("sheets_append", rows=len(values)):
+                self.handle.call(lambda ws: ws.append_rows(values, value_input_option="USER_ENTERED"))
+        except Exception as e:
+            with self.pool.write() as c:
+                c.executemany(
+                    "UPDATE sheets_outbox SET attempts=?, next_attempt_at=?, last_error=? WHERE id=?",
+                    [(r[7] + 1, now + min(self.max_backoff, self.base_backoff * 2 ** r[7]), str(e)[:500], r[0])
+                     for r in rows],
+                )
+            return 0
+        synced = datetime.now(timezone.utc)
+        with self.pool.write() as c:
+            c.executemany("UPDATE sheets_outbox SET synced_at=?, last_error=NULL WHERE id=?",
+                          [(synced.strftime("%Y-%m-%d %H:%M:%S"), r[0]) for r in rows])
+            c.execute("DELETE FROM sheets_outbox WHERE synced_at < ?",
+                      ((synced - timedelta(hours=self.keep_synced_hours)).strftime("%Y-%m-%d %H:%M:%S"),))
+        return len(rows)
+
+def outbox_pending(max_attempts: int = OUTBOX_MAX_ATTEMPTS) -> int:
+    """שורות שעדיין ינוסו (כולל בהמתנה ל-backoff)"""
+    with db_read() as c:
+        return c.execute("SELECT COUNT(*) FROM sheets_outbox WHERE synced_at IS NULL AND attempts < ?",
+                         (max_attempts,)).fetchone()[0]
+
+def outbox_failed(max_attempts: int = OUTBOX_MAX_ATTEMPTS) -> pd.DataFrame:
+    """שורות שנעצרו אחרי max_attempts ניסיונות, עם השגיאה האחרונה"""
+    with db_read() as c:
+        return pd.read_sql_query("""SELECT id, record_id, created_at, branch, chef_name, dish_name, score, attempts, last_error
+                                    FROM sheets_outbox WHERE synced_at IS NULL AND attempts >= ? ORDER BY id""",
+                                 c, params=(max_attempts,))
+
+def outbox_retry_failed(max_attempts: int = OUTBOX_MAX_ATTEMPTS) -> int:
+    """מחזיר לתור את השורות שנעצרו (פעולת מנהל, אחרי תיקון הבעיה)"""
+    with db_write() as c:
+        n = c.execute("UPDATE sheets_outbox SET attempts = 0, next_attempt_at = 0 WHERE synced_at IS NULL AND attempts >= ?",
+                      (max_attempts,)).rowcount
+    worker = sheets_worker()
+    if worker is not None: worker.wake()
+    return n
+
+@st.cache_resource
+def sheets_worker() -> Optional[SheetsOutboxWorker]:
+    """worker יחיד לתהליך; None אם Sheets לא מוגדר"""
+    handle = get_sheets_handle()
+    return SheetsOutboxWorker(handle).start() if handle is not None else None
+
+# ---------- שכבת Secrets: GPT ----------
+# ה-SDK של openai (~250ms ייבוא) נטען רק כשבאמת שולחים בקשה; ה-client נבנה פעם אחת לתהליך
+def openai_config_error() -> Optional[str]:
+    """בדיקת הגדרות בלבד — בלי לייבא את openai. None = מוגדר"""
+    api_key = st.secrets.get("OPENAI_API_KEY", "")
+    if not api_key or api_key == "sk-PASTE_YOUR_KEY_HERE":
+        return "חסר OPENAI_API_KEY תקין ב-secrets.toml"
+    return None
+
+@st.cache_resource(show_spinner=False)
+def _openai_client(api_key: str, org: str, proj: str):
+    with trace("openai_client_init"):
+        from openai import OpenAI
+        kw = {"api_key": api_key, "timeout": GPT_TIMEOUT_S, "max_retries": 1}
+        if org: kw["organization"] = org
+        if proj: kw["project"] = proj
+        return OpenAI(**kw)
+
+def get_openai_client():
+    """מחזיר OpenAI client או שגיאה"""
+    err = openai_config_error()
+    if err:
+        return None, err
+    try:
+        return _openai_client(st.secrets.get("OPENAI_API_KEY", ""), st.secrets.get("OPENAI_ORG", ""),
+                              st.secrets.get("OPENAI_PROJECT", "")), None
+    except Exception as e:
+        return None, f"שגיאת OpenAI: {e}"
+
+# ---------- לוגיקה ----------
+def score_hint(x:int)->str: 
+    return "😟 חלש" if x<=3 else ("🙂 סביר" if x<=6 else ("😀 טוב" if x<=8 else "🤩 מצוין"))
+
+def has_recent_duplicate(branch:str, chef:str, dish:str, hours:int=DUP_HOURS)->bool:
+    if hours<=0: return False
+    cutoff = (datetime.now(timezone.utc)-timedelta(hours=hours)).strftime("%Y-%m-%d %H:%M:%S")
+    with db_read() as c:
+        cur = c.execute("""SELECT 1 FROM food_quality WHERE branch=? AND chef_name=? AND dish_name=? AND created_at >= ? LIMIT 1""",
+                        (branch.strip(), chef.strip(), dish.strip(), cutoff))
+        return cur.fetchone() is not None
+
+def insert_record(branch:str, chef:str, dish:str, score:int, notes:str, submitted_by:Optional[str]=None):
+    ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    row = (branch.strip(), chef.strip(), dish.strip(), int(score), (notes or "").strip(), ts)
+    worker = sheets_worker()
+    # SQLite (+ תור ל-Sheets באותה טרנזקציה)
+    with db_write() as c:
+        cur = c.execute("""INSERT INTO food_quality (branch, chef_name, dish_name, score, notes, created_at, submitted_by)
+                           VALUES (?, ?, ?, ?, ?, ?, ?)""", row + (submitted_by,))
+        if worker is not None:
+            c.execute("""INSERT INTO sheets_outbox (record_id, branch, chef_name, dish_name, score, notes, created_at)
+                         VALUES (?, ?, ?, ?, ?, ?, ?)""", (cur.lastrowid,) + row)
+    # Sheets — ברקע
+    if worker is not None:
+        worker.wake()
+        st.toast("נשמר ✅ — יסונכרן ל-Google Sheets ברקע", icon="✅")
+    else:
+        st.toast("נשמר מקומית בלבד ℹ️", icon="ℹ️")
+
+# ---------- ייבוא היסטורי ----------
+# CSV מהגיליון (כותרות SHEET_HEADERS) או מייצוא ה-CSV של האפליקציה (שמות עמודות ב-DB).
+# בדיקות תקינות וכפילויות — וקטוריות על כל הקובץ; הכנסה — טרנזקציה אחת עם executemany.
+IMPORT_COLUMNS = dict(zip(SHEET_HEADERS, ["created_at", "branch", "chef_name", "dish_name", "score", "notes"]))
+IMPORT_FIELDS = ["created_at", "branch", "chef_name", "dish_name", "score", "notes"]
+
+DAYFIRST_RE = r"^\d{1,2}[./]\d{1,2}[./]\d{2,4}(?:\D|$)"  # 17/10/2025 9:05, 03.01.2025
+
+def _parse_import_times(s: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    """מחזיר (זמנים נאיביים ב-UTC, האם השורה כבר בפורמט הקנוני YYYY-MM-DD HH:MM:SS).
+    סדר: הפורמט הקנוני (מהיר), ISO-8601 (שנה קודם — בלי להחליף יום/חודש; היסט אזור זמן מומר ל-UTC),
+    ורק מחרוזות שמתחילות ביום עם / או . — יום לפני חודש. כל מה שלא מתפענח — NaT (השורה נדחית, לא הקובץ)."""
+    fast = pd.to_datetime(s, format="%Y-%m-%d %H:%M:%S", errors="coerce")
+    canon = fast.notna()
+    t = fast
+    rest = ~canon & (s != "")
+    if rest.any():
+        iso = pd.to_datetime(s[rest], format="ISO8601", errors="coerce", utc=True).dt.tz_localize(None)
+        t = t.combine_first(iso)
+        rest &= t.isna() & s.str.match(DAYFIRST_RE)
+        if rest.any():
+            dmy = pd.to_datetime(s[rest], format="mixed", dayfirst=True, errors="coerce", utc=True).dt.tz_localize(None)
+            t = t.combine_first(dmy)
+    return t, canon
+
+def _validate_import(raw: pd.DataFrame) -> Tuple[pd.DataFrame, pd.Series]:
+    """מחזיר (שורות מנורמלות, סיבת דחייה לכל שורה — "" לתקינות)"""
+    df = raw.rename(columns=IMPORT_COLUMNS)
+    missing = [h for h, col in IMPORT_COLUMNS.items() if col not in df.columns and col != "notes"]
+    if missing:
+        raise ValueError(f"עמודות חסרות בקובץ: {', '.join(missing)}")
+    if "notes" not in df: df["notes"] = ""
+    df = df[IMPORT_FIELDS].apply(lambda col: col.str.strip())
+    when, canon = _parse_import_times(df["created_at"])
+    score = pd.to_numeric(df["score"], errors="coerce")
+    reason = pd.Series("", index=df.index)
+    # סדר הפוך — הסיבה הראשונה ברשימה היא זו שנשארת
+    for bad, why in [
+        (~score.between(1, 10) | (score % 1 != 0), "ציון חייב להיות מספר שלם 1–10"),
+        (~df["dish_name"].isin(DISHES), "מנה לא מוכרת"),
+        (df["chef_name"] == "", "חסר שם טבח"),
+        (~df["branch"].isin(BRANCHES), "סניף לא מוכר"),
+        (when.isna(), "תאריך/שעה לא תקין"),
+    ]:
+        reason[bad] = why
+    ok = reason == ""
+    df["score"] = score.where(ok, 0).astype("int64")
+    # שומרים את המחרוזת המקורית רק כשהיא כבר בפורמט הקנוני (מהיר בהרבה מ-strftime על מיליון שורות);
+    # כל פורמט אחר — גם באותו אורך (17/10/2025 12:30:00) — מנורמל, אחרת השוואות התאריכים כמחרוזות נשברות
+    df.loc[ok & ~canon, "created_at"] = when[ok & ~canon].dt.strftime("%Y-%m-%d %H:%M:%S")
+    df["_t"] = when
+    return df, reason
+
+def _import_duplicates(c: sqlite3.Connection, df: pd.DataFrame, hours: int) -> pd.Series:
+    """כלל DUP_HOURS על כל הקובץ במעבר אחד: שורה נדחית אם קיימת לפניה (ב-DB או שורה שהתקבלה
+    מהקובץ) בדיקה לאותו סניף/טבח/מנה בטווח hours. ייבוא חוזר של אותו קובץ לא מכפיל."""
+    dup = pd.Series(False, index=df.index)
+    if hours <= 0 or df.empty:
+        return dup
+    window = hours * 3600
+    lo = (df["_t"].min() - timedelta(hours=hours)).strftime("%Y-%m-%d %H:%M:%S")
+    hi = df["_t"].max().strftime("%Y-%m-%d %H:%M:%S")
+    old = pd.read_sql_query("""SELECT branch, chef_name, dish_name, created_at FROM food_quality
+                               WHERE created_at BETWEEN ? AND ?""", c, params=(lo, hi))
+    old["_t"] = pd.to_datetime(old["created_at"], format="%Y-%m-%d %H:%M:%S", errors="coerce")
+    keys = ["branch", "chef_name", "dish_name"]
+    both = pd.concat([old[keys + ["_t"]].assign(_new=False), df[keys + ["_t"]].assign(_new=True)])
+    both["_row"] = np.r_[np.full(len(old), -1), np.arange(len(df))]
+    both = both.sort_values(keys + ["_t", "_new"], kind="stable")  # בשוויון זמנים — הקיימת קודם
+    grp = both.groupby(keys, sort=False).ngroup().to_numpy()
+    t = both["_t"].to_numpy().astype("datetime64[s]").astype(np.int64)
+    new = both["_new"].to_numpy()
+    same = np.r_[False, grp[1:] == grp[:-1]]
+    close = same & (np.r_[0, np.diff(t)] <= window) & new
+    # רוב השורות רחוקות מקודמתן ומתקבלות מיד; רק רצפים צפופים נבדקים מול השורה האחרונה שהתקבלה
+    kept = ~close
+    for i in np.flatnonzero(close):
+        j = i - 1
+        while not kept[j]: j -= 1
+        kept[i] = t[i] - t[j] > window
+    rows = both["_row"].to_numpy()
+    dup.iloc[rows[new & ~kept]] = True
+    return dup
+
+def import_records(source, hours: int = DUP_HOURS, submitted_by: str = "import", to_sheets: bool = False,
+                   progress: Optional[Callable[[int, int], None]] = None) -> Tuple[int, pd.DataFrame]:
+    """ייבוא בדיקות היסטוריות מ-CSV (נתיב או קובץ פתוח). מחזיר (כמה נוספו, שורות שנדחו + סיבה).
+    השעות נשמרות כמו שהן (בגיליון — UTC, כמו באפליקציה). to_sheets מוסיף את השורות לתור ל-Sheets."""
+    raw = pd.read_csv(source, dtype=str, keep_default_na=False, encoding="utf-8-sig")
+    with trace("import_records", rows=len(raw)):
+        df, reason = _validate_import(raw)
+        ok = reason == ""
+        worker = sheets_worker() if to_sheets else None
+        with db_write() as c:
+            # טרנזקציה מפורשת: sqlite3 פותח אחת לבד רק לפני INSERT/UPDATE/DELETE, ו-DROP TRIGGER
+            # בלעדיה נשמר מיד — כשל באמצע היה משאיר את ה-DB בלי טריגרים. כך גם בדיקת הכפילויות
+            # וההכנסה רואות את אותו מצב.
+            c.execute("BEGIN IMMEDIATE")
+            dup = _import_duplicates(c, df[ok], hours)
+            reason[dup[dup].index] = f"כפילות (אותו סניף/טבח/מנה בטווח {hours} שעות)"
+            good = df[reason == ""].sort_values("_t", kind="stable")
+            rows = list(zip(*(good[col].tolist() for col in ("branch", "chef_name", "dish_name", "score", "notes", "created_at")),
+                            [submitted_by] * len(good)))
+            first_id = c.execute("SELECT COALESCE(MAX(id), 0) FROM food_quality").fetchone()[0]
+            # הטריגרים מעדכנים את טבלאות הסיכום שורה-שורה; בייבוא — מכבים ומעדכנים פעם אחת בסוף
+            for t in ("ins", "del", "upd"):
+                c.execute(f"DROP TRIGGER IF EXISTS trg_rollup_{t}")
+            # מטמון דפים גדול לזמן הייבוא — כל האינדקסים של food_quality מתעדכנים לכל שורה
+            cache_size = c.execute("PRAGMA cache_size").fetchone()[0]
+            c.execute(f"PRAGMA cache_size = -{IMPORT_CACHE_KB}")
+            try:
+                for start in range(0, len(rows), IMPORT_CHUNK):
+                    c.executemany("""INSERT INTO food_quality (branch, chef_name, dish_name, score, notes, created_at, submitted_by)
+                                     VALUES (?, ?, ?, ?, ?, ?, ?)""", rows[start:start + IMPORT_CHUNK])
+                    if progress: progress(min(start + IMPORT_CHUNK, len(rows)), len(rows))
+            finally:
+                c.execute(f"PRAGMA cache_size = {cache_size}")
+            for kind, (k1, k2) in ROLLUPS.items():
+                c.execute(f"""INSERT INTO rollup_{kind} (day, {k1}, {k2}, n, s, ss)
+                              SELECT substr(created_at, 1, 10), {k1}, {k2}, COUNT(*), SUM(score), SUM(score * score)
+                              FROM food_quality WHERE id > ? GROUP BY 1, 2, 3
+                              ON CONFLICT (day, {k1}, {k2}) DO UPDATE
+                              SET n = n + excluded.n, s = s + excluded.s, ss = ss + excluded.ss""", (first_id,))
+            for q in _rollup_ddl(): c.execute(q)
+            if worker is not None:
+                c.execute("""INSERT INTO sheets_outbox (record_id, branch, chef_name, dish_name, score, notes, created_at)
+                             SELECT id, branch, chef_name, dish_name, score, notes, created_at
+                             FROM food_quality WHERE id > ? ORDER BY id""", (first_id,))
+        if worker is not None:
+            worker.wake()
+    rejects = raw[reason != ""].assign(**{"שורה": reason.index[reason != ""] + 2, "סיבה": reason[reason != ""]})
+    return len(rows), rejects
+
+# ---------- KPI (אגרגציה ב-SQL) ----------
+# נקרא מטבלאות הסיכום היומיות (מאות שורות) ולא מטבלת הבדיקות; לכל ממד בוחרים מוביל.
+# (n >= סף) DESC מעדיף מי שעובר את הסף, ואם אין כזה — המוביל הזמין (כמו בגרסת pandas).
+KPI_SQL = """
+WITH
+b AS (SELECT branch AS name, SUM(n) AS n, CAST(SUM(s) AS REAL)/SUM(n) AS avg FROM rollup_branch_dish GROUP BY branch),
+c AS (SELECT chef_name AS name, SUM(n) AS n, CAST(SUM(s) AS REAL)/SUM(n) AS avg FROM rollup_branch_chef GROUP BY chef_name),
+d AS (SELECT dish_name AS name, SUM(n) AS n, CAST(SUM(s) AS REAL)/SUM(n) AS avg FROM rollup_branch_dish GROUP BY dish_name)
+SELECT * FROM (SELECT 'branch_count' AS kpi, name, n, avg FROM b ORDER BY n DESC, name LIMIT 1)
+UNION ALL
+SELECT * FROM (SELECT 'branch_avg', name, n, avg FROM b ORDER BY (n >= :min_n) DESC, avg DESC, n DESC, name LIMIT 1)
+UNION ALL
+SELECT * FROM (SELECT 'top_chef', name, n, avg FROM c ORDER BY (n >= :min_m) DESC, n DESC, avg DESC, name LIMIT 1)
+UNION ALL
+SELECT * FROM (SELECT 'top_dish', name, n, avg FROM d ORDER BY n DESC, name LIMIT 1)
+"""
+
+@st.cache_data(ttl=15)
+def load_kpis(min_n:int=MIN_BRANCH_LEADER_N, min_m:int=MIN_CHEF_TOP_M) -> pd.DataFrame:
+    """מחזיר עד 4 שורות (kpi, name, n, avg) — ריק אם אין נתונים"""
+    trace_note(cache_hit=False)  # רץ רק כשאין תוצאה במטמון
+    with db_read() as c:
+        kpis = pd.read_sql_query(KPI_SQL, c, params={"min_n": min_n, "min_m": min_m})
+    kpis = kpis.set_index("kpi")
+    kpis.attrs.update(min_n=min_n, min_m=min_m)  # לבדיקה ב-kpi_* (נשמר גם במטמון)
+    return kpis
+
+def _kpi_row(kpis:pd.DataFrame, key:str, **thresholds):
+    if kpis.index.name != "kpi":
+        raise ValueError("פונקציות kpi_* מקבלות את התוצאה של load_kpis, לא את טבלת הבדיקות")
+    for name, value in thresholds.items():
+        if value is not None and value != kpis.attrs.get(name):
+            raise ValueError(f"{name}={value} לא תואם ל-load_kpis ({name}={kpis.attrs.get(name)}) — הסף מוחל בשאילתה")
+    return kpis.loc[key] if key in kpis.index else None
+
+# הפונקציות מקבלות את התוצאה של load_kpis; הספים מוחלים כבר בשאילתה.
+# min_n/min_m נשארו בחתימה לתאימות: None = מה ש-load_kpis קיבל; ערך אחר — ValueError.
+def kpi_best_branch_by_count(df:pd.DataFrame)->Tuple[Optional[str],int]:
+    row = _kpi_row(df, "branch_count")
+    if row is None: return None,0
+    return str(row["name"]), int(row["n"])
+
+def kpi_best_avg_branch(df:pd.DataFrame, min_n:Optional[int]=None)->Tuple[Optional[str],Optional[float],int]:
+    row = _kpi_row(df, "branch_avg", min_n=min_n)
+    if row is None: return None,None,0
+    return str(row["name"]), float(row["avg"]), int(row["n"])
+
+def kpi_top_chef(df:pd.DataFrame, min_m:Optional[int]=None)->Tuple[Optional[str],Optional[float],int]:
+    row = _kpi_row(df, "top_chef", min_m=min_m)
+    if row is None: return None,None,0
+    return str(row["name"]), float(row["avg"]), int(row["n"])
+
+def kpi_top_dish(df:pd.DataFrame)->Tuple[Optional[str],int]:
+    row = _kpi_row(df, "top_dish")
+    if row is None: return None,0
+    return str(row["name"]), int(row["n"])
+
+# ---------- מגמות וחריגים ----------
+# לכל צירוף (סניף, מנה) ו-(טבח, מנה): ממוצע נע של TREND_DAYS האחרונים, ממוצע משוקלל-דועך (EWM)
+# ושינויו באותו חלון, ו-z של החלון מול כל מה שלפניו. הבסיס: סיכומים שבועיים (n, s, ss) בזיכרון —
+# נבנים מטבלאות הסיכום היומיות, ובכל בדיקה חדשה מתווספות רק השורות החדשות ומחושבים מחדש רק
+# הצירופים שנגעו בהם. כל המדדים הם סכומים משוקללים לפי שבוע — בלי רשת שבועות מלאה ובלי לולאות.
+TREND_KINDS = ("branch_dish", "chef_dish")
+TREND_WEEKS = TREND_DAYS // 7
+WEEK_SQL = "date({}, '-6 days', 'weekday 0')"  # יום ראשון של השבוע
+
+@st.cache_resource
+def _trend_store() -> dict:
+    return {"lock": threading.Lock(), "last_id": 0, "weekly": {}, "summary": {}, "as_of": None}
+
+WEEKLY_DTYPES = {"n": "int64", "s": "int64", "ss": "int64"}  # גם כשהשאילתה ריקה
+
+def _weekly_from_rollups(c: sqlite3.Connection, kind: str) -> pd.DataFrame:
+    k1, k2 = ROLLUPS[kind]
+    return pd.read_sql_query(f"""SELECT {k1}, {k2}, {WEEK_SQL.format('day')} AS week, SUM(n) AS n, SUM(s) AS s, SUM(ss) AS ss
+                                 FROM rollup_{kind} GROUP BY 1, 2, 3""", c, index_col=[k1, k2, "week"],
+                             dtype=WEEKLY_DTYPES)
+
+def _weekly_from_rows(c: sqlite3.Connection, kind: str, after_id: int, upto_id: int) -> pd.DataFrame:
+    k1, k2 = ROLLUPS[kind]
+    return pd.read_sql_query(f"""SELECT {k1}, {k2}, {WEEK_SQL.format('created_at')} AS week,
+                                        COUNT(*) AS n, SUM(score) AS s, SUM(score * score) AS ss
+                                 FROM food_quality WHERE id > ? AND id <= ? GROUP BY 1, 2, 3""",
+                             c, params=(after_id, upto_id), index_col=[k1, k2, "week"], dtype=WEEKLY_DTYPES)
+
+def _derive_trends(weekly: pd.DataFrame, as_of: pd.Timestamp) -> pd.DataFrame:
+    """מדדי מגמה לכל צירוף, נכון לשבוע as_of"""
+    w = weekly.reset_index()
+    keys = list(w.columns[:2])
+    age = (as_of - pd.to_datetime(w["week"])).dt.days.to_numpy() // 7
+    recent = age < TREND_WEEKS
+    decay = 0.5 ** (1 / TREND_HALFLIFE_WEEKS)
+    # EWM משוקלל לפי מספר בדיקות: Σw·s / Σw·n, עכשיו ולפני TREND_WEEKS שבועות
+    w_now = decay ** age
+    w_prev = np.where(recent, 0.0, decay ** (age - TREND_WEEKS))
+    parts = pd.DataFrame({
+        "n": w["n"], "rn": w["n"] * recent, "rs": w["s"] * recent,
+        "bn": w["n"] * ~recent, "bs": w["s"] * ~recent, "bss": w["ss"] * ~recent,
+        "en": w_now * w["n"], "es": w_now * w["s"], "pn": w_prev * w["n"], "ps": w_prev * w["s"],
+        "last_week": pd.to_datetime(w["week"]),
+    })
+    g = pd.concat([w[keys], parts], axis=1).groupby(keys, sort=False).agg(
+        {**{c: "sum" for c in parts.columns if c != "last_week"}, "last_week": "max"})
+    out = pd.DataFrame(index=g.index)
+    out["n"] = g["n"]
+    out["n_recent"] = g["rn"]
+    out["mean_recent"] = g["rs"] / g["rn"].where(g["rn"] > 0)
+    out["ewm"] = g["es"] / g["en"]
+    out["trend"] = out["ewm"] - g["ps"] / g["pn"].where(g["pn"] > 0)
+    base = g["bs"] / g["bn"].where(g["bn"] > 0)
+    # סטיית תקן מינימלית של חצי נקודה — היסטוריה אחידה לא תיתן z אינסופי
+    base_sd = ((g["bss"] - g["bs"] * base) / (g["bn"] - 1).where(g["bn"] > 1)).clip(lower=0.25).pow(0.5)
+    out["baseline"] = base
+    out["z"] = (out["mean_recent"] - base) / (base_sd / g["rn"].where(g["rn"] > 0).pow(0.5))
+    out["anomaly"] = (out["z"].abs() >= ANOMALY_Z) & (g["rn"] >= ANOMALY_MIN_N) & (g["bn"] >= ANOMALY_BASELINE_MIN_N)
+    out["last_week"] = g["last_week"]
+    return out
+
+def _sync_trends(store: dict):
+    """מביא את הסיכומים השבועיים והמדדים לגרסה הנוכחית של ה-DB (נקרא תחת המנעול)"""
+    with db_read() as c:
+        c.execute("BEGIN")  # snapshot אחד: max(id) וטבלאות הסיכום מאותו רגע
+        try:
+            max_id = c.execute("SELECT COALESCE(MAX(id), 0) FROM food_quality").fetchone()[0]
+            if max_id == store["last_id"] and store["weekly"]:
+                return
+            full = not store["weekly"] or max_id < store["last_id"]
+            touched = {}
+            for kind in TREND_KINDS:
+                if full:
+                    store["weekly"][kind] = _weekly_from_rollups(c, kind)
+                    continue
+                new = _weekly_from_rows(c, kind, store["last_id"], max_id)
+                old = store["weekly"][kind]
+                hit = new.index.isin(old.index)
+                old.loc[new.index[hit]] = old.loc[new.index[hit]].to_numpy() + new[hit].to_numpy()
+                store["weekly"][kind] = pd.concat([old, new[~hit]]) if (~hit).any() else old
+                touched[kind] = new.index.droplevel("week").unique()
+        finally:
+            c.commit()
+    store["last_id"] = max_id
+    weeks = [w.index.get_level_values("week").max() for w in store["weekly"].values() if not w.empty]
+    as_of = pd.Timestamp(max(weeks)) if weeks else None
+    for kind in TREND_KINDS:
+        weekly = store["weekly"][kind]
+        if full or as_of != store["as_of"] or weekly.empty:
+            store["summary"][kind] = _derive_trends(weekly, as_of if as_of is not None else pd.Timestamp(0))
+        elif len(touched[kind]):
+            # אותו שבוע נוכחי — רק הצירופים שקיבלו בדיקות חדשות משתנים
+            part = _derive_trends(weekly[weekly.index.droplevel("week").isin(touched[kind])], as_of)
+            prev = store["summary"][kind]
+            store["summary"][kind] = pd.concat([prev[~prev.index.isin(part.index)], part])
+    store["as_of"] = as_of
+
+def load_trends(kind: str = "branch_dish") -> pd.DataFrame:
+    """מדדי מגמה לכל צירוף ב-kind (branch_dish / chef_dish). משותף לכל הסשנים — לקריאה בלבד."""
+    store = _trend_store()
+    with store["lock"], trace("load_trends", kind=kind) as rec:
+        before = store["last_id"], bool(store["weekly"])
+        _sync_trends(store)
+        rec["cache_hit"] = before == (store["last_id"], True)
+        rec["rows"] = len(store["summary"][kind])
+        return store["summary"][kind]
+
+def trends_as_of() -> Optional[pd.Timestamp]:
+    """השבוע האחרון שיש בו נתונים — נקודת הייחוס של load_trends"""
+    return _trend_store()["as_of"]
+
+def trend_series(kind: str, k1: str, k2: str) -> pd.DataFrame:
+    """סדרה שבועית לצירוף אחד: n, ממוצע שבועי, ממוצע נע (TREND_WEEKS) ו-EWM — לגרף"""
+    store = _trend_store()
+    with store["lock"]:
+        _sync_trends(store)
+        weekly = store["weekly"][kind]
+        if (k1, k2) not in weekly.index.droplevel("week"):
+            return pd.DataFrame(columns=["n", "mean", "rolling", "ewm"])
+        w = weekly.xs((k1, k2), level=[0, 1]).copy()
+    w.index = pd.to_datetime(w.index)
+    w = w.sort_index().resample("W-SUN", label="left", closed="left").sum()  # שבועות ריקים = 0
+    roll = w[["n", "s"]].rolling(TREND_WEEKS, min_periods=1).sum()
+    ewm = w[["n", "s"]].ewm(halflife=TREND_HALFLIFE_WEEKS).mean()
+    return pd.DataFrame({"n": w["n"], "mean": w["s"] / w["n"].where(w["n"] > 0),
+                         "rolling": roll["s"] / roll["n"].where(roll["n"] > 0),
+                         "ewm": ewm["s"] / ewm["n"].where(ewm["n"] > 0)})
+
+# ---------- היסטוריה (דפדוף keyset) ----------
+# סדר קבוע: (created_at, id) יורד. הסמן = (created_at, id) של השורה האחרונה בעמוד,
+# והעמוד הבא מתחיל "אחריו" דרך האינדקס — בלי OFFSET ובלי לספור/לקרוא את כל הטבלה.
+HISTORY_COLUMNS = "id, created_at, branch, chef_name, dish_name, score, notes, submitted_by"
+Cursor = Tuple[str, int]
+
+def _history_where(branch: Optional[str], chef: Optional[str], dish: Optional[str],
+                   date_from: Optional[str], date_to: Optional[str],
+                   score_min: int, score_max: int) -> Tuple[List[str], list]:
+    where, params = [], []
+    for col, val in (("branch", branch), ("chef_name", chef), ("dish_name", dish)):
+        if val:
+            where.append(f"{col} = ?"); params.append(val)
+    if date_from:
+        where.append("created_at >= ?"); params.append(date_from)
+    if date_to:  # כולל את כל יום הסיום
+        where.append("created_at < date(?, '+1 day')"); params.append(date_to)
+    if score_min > 1 or score_max < 10:
+        where.append("score BETWEEN ? AND ?"); params += [score_min, score_max]
+    return where, params
+
+def history_page(branch: Optional[str] = None, chef: Optional[str] = None, dish: Optional[str] = None,
+                 date_from: Optional[str] = None, date_to: Optional[str] = None,
+                 score_min: int = 1, score_max: int = 10,
+                 after: Optional[Cursor] = None, limit: int = HISTORY_PAGE_SIZE
+                 ) -> Tuple[pd.DataFrame, Optional[Cursor]]:
+    """עמוד אחד של בדיקות, מהחדשה לישנה; מחזיר (עמוד, סמן לעמוד הבא או None).
+    תאריכים בפורמט YYYY-MM-DD."""
+    where, params = _history_where(branch, chef, dish, date_from, date_to, score_min, score_max)
+    if after is not None:
+        where.append("(created_at, id) < (?, ?)"); params += list(after)
+    q = (f"SELECT {HISTORY_COLUMNS} FROM food_quality"
+         + (" WHERE " + " AND ".join(where) if where else "")
+         + " ORDER BY created_at DESC, id DESC LIMIT ?")
+    with trace("history_page") as rec, db_read() as c:
+        page = pd.read_sql_query(q, c, params=params + [limit + 1])  # שורה עודפת = יש עמוד הבא
+        rec["rows"] = min(len(page), limit)
+    if len(page) <= limit:
+        return page, None
+    page = page.iloc[:limit]
+    last = page.iloc[-1]
+    return page, (str(last["created_at"]), int(last["id"]))
+
+@st.cache_data(ttl=60)
+def history_chefs(branch: Optional[str] = None) -> List[str]:
+    """שמות טבחים לסינון — מטבלת הסיכום (קטנה בהרבה מ-food_quality)"""
+    q = "SELECT DISTINCT chef_name FROM rollup_branch_chef" + (" WHERE branch = ?" if branch else "") + " ORDER BY 1"
+    with db_read() as c:
+        return [r[0] for r in c.execute(q, (branch,) if branch else ())]
+
+# ---------- ייצוא (בחלקים, לפי בקשה) ----------
+# קוראים מה-cursor EXPORT_CHUNK שורות בכל פעם וכותבים ישר לקובץ היעד — בלי DataFrame של כל
+# הטבלה ובלי מחרוזת CSV מלאה. הסדר (created_at, id) מגיע מהאינדקס, בלי מיון זמני.
+EXPORT_FORMATS = {"csv": ("CSV", "csv", "text/csv"),
+                  "csv.gz": ("CSV דחוס (gzip)", "csv.gz", "application/gzip"),
+                  "parquet": ("Parquet (zstd)", "parquet", "application/octet-stream")}
+
+def export_chunks(branch: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                  chunksize: int = EXPORT_CHUNK) -> Iterator[pd.DataFrame]:
+    where, params = _history_where(branch, None, None, date_from, date_to, 1, 10)
+    q = (f"SELECT {DF_COLUMNS} FROM food_quality" + (" WHERE " + " AND ".join(where) if where else "")
+         + " ORDER BY created_at, id")
+    with db_read() as c:
+        yield from pd.read_sql_query(q, c, params=params, chunksize=chunksize)
+
+def write_export(out: BinaryIO, fmt: str = "csv", **filters) -> int:
+    """כותב את הבדיקות (סינון: branch/date_from/date_to) לקובץ בינארי פתוח; מחזיר מספר שורות"""
+    rows = 0
+    with trace("export", fmt=fmt) as rec:
+        if fmt == "parquet":
+            import pyarrow as pa  # תלות של streamlit; נטען רק כשמייצאים
+            import pyarrow.parquet as pq
+            schema = pa.schema([("id", pa.int64()), ("branch", pa.string()), ("chef_name", pa.string()),
+                                ("dish_name", pa.string()), ("score", pa.int64()), ("notes", pa.string()),
+                                ("created_at", pa.string())])
+            with pq.ParquetWriter(out, schema, compression="zstd") as w:
+                for chunk in export_chunks(**filters):
+                    w.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+                    rows += len(chunk)
+        else:
+            raw = gzip.GzipFile(fileobj=out, mode="wb") if fmt == "csv.gz" else out
+            f = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+            try:
+                for chunk in export_chunks(**filters):
+                    chunk.to_csv(f, index=False, header=rows == 0)
+                    rows += len(chunk)
+            finally:
+                f.flush(); f.detach()
+                if raw is not out: raw.close()  # סוגר רק את שכבת ה-gzip
+        rec["rows"] = rows
+    return rows
+
+# ---------- תקציר נתונים ל-GPT ----------
+# במקום CSV של 400 השורות האחרונות: תקציר סטטיסטי על כל ההיסטוריה (מטבלאות הסיכום)
+# + מדגם הערות אינפורמטיביות, בתוך תקציב טוקנים.
+def _approx_tokens(text: str) -> int:
+    return int(len(text) / 2.5) + 1  # עברית ≈ 2–3 תווים לטוקן
+
+def _take_lines(lines: List[str], budget: int) -> Tuple[List[str], int]:
+    """מוסיף שורות עד שנגמר התקציב; מחזיר (שורות, תקציב שנותר)"""
+    out = []
+    for ln in lines:
+        t = _approx_tokens(ln)
+        if t > budget: break
+        out.append(ln); budget -= t
+    return out, budget
+
+def _entity_stats(c: sqlite3.Connection, kind: str, key: str, recent_from: str) -> pd.DataFrame:
+    """סיכום לכל ערך של key (הקיבוץ ב-SQL — לא טוענים את השורות היומיות)"""
+    g = pd.read_sql_query(
+        f"""SELECT {key}, SUM(n) AS n, SUM(s) AS s, SUM(ss) AS ss,
+                   SUM(CASE WHEN day >= :r THEN n END) AS rn, SUM(CASE WHEN day >= :r THEN s END) AS rs,
+                   SUM(CASE WHEN day < :r THEN n END) AS pn, SUM(CASE WHEN day < :r THEN s END) AS ps
+            FROM rollup_{kind} GROUP BY {key}""",
+        c, params={"r": recent_from}, index_col=key,
+    )
+    g["mean"] = g["s"] / g["n"]
+    g["std"] = ((g["ss"] - g["s"] * g["mean"]) / (g["n"] - 1)).clip(lower=0).pow(0.5)
+    g["trend"] = g["rs"] / g["rn"] - g["ps"] / g["pn"]  # NaN אם אין נתונים באחד החלונות
+    return g.sort_values("n", ascending=False)
+
+def _stats_lines(title: str, g: pd.DataFrame, limit: int) -> List[str]:
+    lines = [f"## {title} (שם|n|ממוצע|סטיית תקן|שינוי ב-{TREND_DAYS} ימים אחרונים)"]
+    for name, row in g.head(limit).iterrows():
+        sd = "" if pd.isna(row["std"]) else f"{row['std']:.2f}"
+        tr = "" if pd.isna(row["trend"]) else f"{row['trend']:+.2f}"
+        lines.append(f"{name}|{int(row['n'])}|{row['mean']:.2f}|{sd}|{tr}")
+    return lines
+
+def _outlier_lines(c: sqlite3.Connection, kind: str, key: str, dish: pd.DataFrame, limit: int = 10) -> List[str]:
+    """צירופים (X, מנה) שממוצעם חורג מממוצע המנה ברשת (|z| >= 2, לפחות 3 בדיקות)"""
+    g = pd.read_sql_query(f"""SELECT {key}, dish_name, SUM(n) AS n, SUM(s) AS s FROM rollup_{kind}
+                              GROUP BY {key}, dish_name HAVING SUM(n) >= 3""", c)
+    g = g.join(dish[["mean","std"]], on="dish_name")
+    g["pm"] = g["s"] / g["n"]
+    g["z"] = (g["pm"] - g["mean"]) / (g["std"] / g["n"].pow(0.5))
+    g = g[g["z"].abs() >= 2].reindex(g["z"].abs().sort_values(ascending=False).index).head(limit)
+    return [f"{r[key]} · {r['dish_name']}|{int(r['n'])}|{r['pm']:.2f} מול {r['mean']:.2f}|z={r['z']:+.1f}"
+            for _, r in g.iterrows() if pd.notna(r["z"])]
+
+NOTES_SAMPLE_SQL = """SELECT branch, dish_name, score, substr(notes, 1, 160), substr(created_at, 1, 10) FROM food_quality
+                      WHERE created_at >= ? AND notes <> '' ORDER BY ABS(score - ?) DESC, created_at DESC LIMIT 300"""
+
+def build_llm_digest(c: sqlite3.Connection, token_budget: int = GPT_TOKEN_BUDGET) -> str:
+    """תקציר טקסטואלי של כל הבדיקות: סיכומים לכל ממד, מגמות, חריגים והערות נבחרות"""
+    first_day, last_day, total_n, total_s = c.execute(
+        "SELECT MIN(day), MAX(day), SUM(n), SUM(s) FROM rollup_branch_dish").fetchone()
+    if not total_n:
+        return "אין נתונים."
+    recent_from = (datetime.fromisoformat(last_day) - timedelta(days=TREND_DAYS)).strftime("%Y-%m-%d")
+    branches = _entity_stats(c, "branch_dish", "branch", recent_from)
+    dishes = _entity_stats(c, "branch_dish", "dish_name", recent_from)
+    chefs = _entity_stats(c, "branch_chef", "chef_name", recent_from)
+
+    header = [f"# סה\"כ {total_n} בדיקות, {first_day} עד {last_day}, ממוצע {total_s / total_n:.2f} (ציון 1–10)"]
+    stats = (header + _stats_lines("סניפים", branches, len(branches)) + _stats_lines("מנות", dishes, len(dishes))
+             + ["## חריגים (צירוף|n|ממוצע מול ממוצע המנה|z)"]
+             + _outlier_lines(c, "branch_dish", "branch", dishes) + _outlier_lines(c, "chef_dish", "chef_name", dishes)
+             + _stats_lines("טבחים (לפי כמות)", chefs, 40))
+    # ~25% מהתקציב נשמר להערות
+    out, left = _take_lines(stats, int(token_budget * 0.75))
+    left += token_budget - int(token_budget * 0.75)
+
+    # הערות מ-TREND_DAYS האחרונים בלבד (טווח ב-idx_food_time, לא סריקה של כל הטבלה — data_version
+    # משתנה בכל שמירה); עדיפות לציונים רחוקים מהממוצע, אחר כך לחדשות; בלי כפילויות טקסט
+    notes = c.execute(NOTES_SAMPLE_SQL, (recent_from, total_s / total_n)).fetchall()
+    seen, note_lines = set(), [f"## הערות נבחרות מ-{TREND_DAYS} הימים האחרונים (תאריך|סניף|מנה|ציון|הערה)"]
+    for b, d, sc, txt, day in notes:
+        k = " ".join(txt.split()).lower()
+        if k in seen: continue
+        seen.add(k)
+        note_lines.append(f"{day}|{b}|{d}|{sc}|{' '.join(txt.split())}")
+    more, _ = _take_lines(note_lines if len(note_lines) > 1 else [], left)
+    return "\n".join(out + more)
+
+def data_version() -> str:
+    """מזהה גרסת נתונים: משתנה בכל הוספה/מחיקה/עדכון ציון"""
+    with db_read() as c:
+        row = c.execute("""SELECT (SELECT COALESCE(MAX(id), 0) FROM food_quality),
+                                  (SELECT COALESCE(SUM(n), 0) FROM rollup_branch_dish),
+                                  (SELECT COALESCE(SUM(s), 0) FROM rollup_branch_dish)""").fetchone()
+    return ":".join(map(str, row))
+
+@st.cache_data(max_entries=8)
+def llm_digest(version: str, token_budget: int = GPT_TOKEN_BUDGET) -> str:
+    trace_note(cache_hit=False)
+    with db_read() as c:
+        return build_llm_digest(c, token_budget)
+
+# ---------- מטמון תשובות GPT ----------
+def _normalize_question(q: str) -> str:
+    return " ".join((q or "").split()).casefold()
+
+def gpt_cache_key(model: str, system_prompt: str, question: str, version: str) -> str:
+    payload = json.dumps([model, system_prompt, _normalize_question(question), version], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def gpt_cache_get(key: str, ttl_hours: float = GPT_CACHE_TTL_HOURS) -> Optional[Tuple[str, float]]:
+    """מחזיר (תשובה, זמן יצירה) אם קיימת ובתוקף"""
+    with db_read() as c:
+        row = c.execute("SELECT answer, created_at FROM gpt_cache WHERE key=? AND created_at >= ?",
+                        (key, time.time() - ttl_hours * 3600)).fetchone()
+    if row is None:
+        return None
+    with db_write() as c:
+        c.execute("UPDATE gpt_cache SET hits = hits + 1, last_hit_at = ? WHERE key = ?", (time.time(), key))
+    return row[0], row[1]
+
+def gpt_cache_put(key: str, model: str, question: str, version: str, answer: str,
+                  ttl_hours: float = GPT_CACHE_TTL_HOURS, max_rows: int = GPT_CACHE_MAX_ROWS):
+    now = time.time()
+    with db_write() as c:
+        c.execute("""INSERT OR REPLACE INTO gpt_cache (key, model, question, data_version, answer, created_at, last_hit_at)
+                     VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                  (key, model, _normalize_question(question), version, answer, now, now))
+        c.execute("DELETE FROM gpt_cache WHERE created_at < ?", (now - ttl_hours * 3600,))
+        c.execute("""DELETE FROM gpt_cache WHERE key IN
+                     (SELECT key FROM gpt_cache ORDER BY last_hit_at DESC LIMIT -1 OFFSET ?)""", (max_rows,))
+
+def stream_completion(client, system_prompt: str, user_prompt: str, model: str = GPT_MODEL,
+                      temperature: float = 0.2, timeout: float = GPT_TIMEOUT_S,
+                      on_done: Optional[Callable[[str], None]] = None) -> Iterator[str]:
+    """מחזיר את התשובה בחלקים כפי שהם מגיעים (stream=True).
+
+    on_done(full_text) נקרא רק אם הזרם הסתיים במלואו. ביטול (rerun/סגירת הגנרטור)
+    סוגר את החיבור ל-OpenAI ולא שומר תשובה חלקית.
+    """
+    # מדידה ידנית (לא trace) — הגנרטור נצרך לאורך זמן ולא בתוך בלוק אחד
+    rec = {"stage": "openai_stream", "run": getattr(_trace_local, "run", None), "ts": time.time(), "model": model}
+    t0 = time.perf_counter()
+    stream = client.chat.completions.create(
+        model=model,
+        messages=[{"role":"system","content": system_prompt},
+                  {"role":"user","content": user_prompt}],
+        temperature=temperature,
+        stream=True,
+        timeout=timeout,
+    )
+    parts: List[str] = []
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if not parts: rec["ttft_ms"] = (time.perf_counter() - t0) * 1000
+                parts.append(delta)
+                yield delta
+        rec["done"] = True
+    finally:
+        close = getattr(stream, "close", None)
+        if close: close()
+        rec.update(ms=(time.perf_counter() - t0) * 1000, rows=len(parts))
+        TRACES.add(rec)
+    if on_done is not None:
+        on_done("".join(parts).strip())
+
+def cached_answer_stream(client, system_prompt: str, user_prompt: str, question: str, version: str,
+                         model: str = GPT_MODEL, temperature: float = 0.2) -> Tuple[Iterator[str], bool]:
+    """מחזיר (זרם תשובה, from_cache). question מזהה את הבקשה (ה-user_prompt נגזר ממנה ומהנתונים)."""
+    key = gpt_cache_key(model, system_prompt, question, version)
+    with trace("gpt_cache_lookup") as rec:
+        hit = gpt_cache_get(key)
+        rec["cache_hit"] = hit is not None
+    if hit is not None:
+        return iter([hit[0]]), True
+    def _store(ans: str):
+        if ans: gpt_cache_put(key, model, question, version, ans)
+    return stream_completion(client, system_prompt, user_prompt, model, temperature, on_done=_store), False
+
+TRACES.add({"stage": "import quality_core", "run": None, "ts": time.time(),
+            "ms": (time.perf_counter() - _IMPORT_T0) * 1000})
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import quality_core as core  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """DB ריק וטרי לכל בדיקה (כולל איפוס המטמונים המשותפים)"""
+    monkeypatch.setattr(core, "DB_PATH", str(tmp_path / "food_quality.db"))
+    core.db_pool.clear()
+    core.init_db()
+    core.refresh_df(full=True)
+    yield core
+    core.db_pool.clear()
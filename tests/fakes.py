@@ -0,0 +1,70 @@
+"""gspread / OpenAI מזויפים לבדיקות — בלי רשת"""
+import types
+
+
+class APIError(Exception):
+    """כמו gspread APIError — הסטטוס ב-e.response.status_code"""
+    def __init__(self, status: int, msg: str = "api error"):
+        super().__init__(msg)
+        self.response = types.SimpleNamespace(status_code=status)
+
+
+CREDS = {"type": "service_account", "project_id": "p", "private_key": "k1", "client_email": "bot@p",
+         "client_id": "1", "token_uri": "https://example/token"}
+
+
+class FakeSheet:
+    """גיליון מזויף: מקבל רק את המפתח הנוכחי (אחרת 401); כל client זוכר עם איזה מפתח נוצר.
+    fail — חריגות שייזרקו בקריאות append הבאות, לפי הסדר; reject(row) — שורה שנדחית תמיד."""
+    def __init__(self, key: str = "k1"):
+        self.key = key
+        self.rows = []
+        self.calls = []
+        self.fail = []
+        self.reject = lambda row: False
+        self.clients = 0
+
+    def client(self, creds: dict = CREDS):
+        sheet, key = self, creds["private_key"]
+        self.clients += 1
+
+        class Worksheet:
+            def append_rows(self, rows, value_input_option=None):
+                sheet.calls.append(len(rows))
+                if key != sheet.key:
+                    raise APIError(401, "invalid key")
+                if sheet.fail:
+                    raise sheet.fail.pop(0)
+                if any(sheet.reject(r) for r in rows):
+                    raise APIError(400, "invalid value")
+                sheet.rows.extend(rows)
+
+        ws = Worksheet()
+        spreadsheet = types.SimpleNamespace(worksheet=lambda name: ws)
+        return types.SimpleNamespace(open_by_url=lambda url: spreadsheet)
+
+
+class FakeOpenAI:
+    """chat.completions.create(stream=True); fail_after=n — החיבור נופל אחרי n חלקים"""
+    def __init__(self, words, fail_after=None):
+        self.calls = 0
+        self.closed = 0
+
+        def create(**kw):
+            self.calls += 1
+            client = self
+
+            class Stream:
+                def __iter__(self):
+                    for i, w in enumerate(words):
+                        if fail_after is not None and i == fail_after:
+                            raise ConnectionError("stream dropped")
+                        delta = types.SimpleNamespace(content=w)
+                        yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)])
+
+                def close(self):
+                    client.closed += 1
+
+            return Stream()
+
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=create))
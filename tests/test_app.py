@@ -0,0 +1,75 @@
+import os
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import quality_core as core
+from fakes import FakeSheet
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app2.py")
+
+
+@pytest.fixture
+def app(db):
+    at = AppTest.from_file(APP, default_timeout=60)
+    at.secrets["ADMIN_PASSWORD"] = "x"
+    at.secrets["OPENAI_API_KEY"] = "sk-test"
+    at.session_state["auth"] = {"role": "meta", "branch": None}
+    return at
+
+
+def button(at, prefix):
+    return next(b for b in at.button if b.label.startswith(prefix))
+
+
+def test_save_and_admin_render(app):
+    app.run()
+    assert not app.exception
+    app.text_input[0].set_value("יוסי")
+    button(app, "💾").click().run()
+    assert not app.exception
+    assert [s.value for s in app.success][0].startswith("נשמר: **")
+    with core.db_read() as c:
+        assert c.execute("SELECT chef_name FROM food_quality").fetchall() == [("יוסי",)]
+    app.session_state["admin_logged_in"] = True
+    app.run()
+    assert not app.exception
+    assert "📈 מגמות" in [s.value for s in app.subheader]
+
+
+def test_admin_shows_and_requeues_failed_outbox_rows(app, monkeypatch):
+    sheet = FakeSheet()
+    worker = core.SheetsOutboxWorker(core.SheetsHandle(sheet.client, "https://sheet", "sheet1"), pool=core.db_pool())
+    monkeypatch.setattr(core, "sheets_worker", lambda: worker)
+    core.insert_record(core.BRANCHES[0], "a", core.DISHES[0], 7, "")
+    with core.db_write() as c:
+        c.execute("UPDATE sheets_outbox SET attempts = ?, last_error = 'invalid value'", (core.OUTBOX_MAX_ATTEMPTS,))
+    app.session_state["admin_logged_in"] = True
+    app.run()
+    assert not app.exception
+    assert any("נכשלו: 1" in c.value for c in app.caption)
+    button(app, "🔁").click().run()
+    assert not app.exception
+    assert core.outbox_failed().empty
+    assert worker.drain_once() == 1
+    assert len(sheet.rows) == 1
+
+
+def test_export_is_offered_once_and_not_kept(app, tmp_path, monkeypatch):
+    spool = tmp_path / "spool"
+    spool.mkdir()
+    monkeypatch.setattr("tempfile.tempdir", str(spool))
+    for chef in ("a", "b"):
+        core.insert_record(core.BRANCHES[0], chef, core.DISHES[0], 7, "")
+    app.session_state["admin_logged_in"] = True
+    app.run()
+    exports = lambda: [d for d in app.get("download_button") if d.label == "⬇️ הורדה"]
+    assert not exports()
+    button(app, "📦").click().run()
+    assert not app.exception
+    assert len(exports()) == 1
+    assert any(c.value.startswith("2 שורות") for c in app.caption)
+    assert "export" not in app.session_state
+    assert list(spool.iterdir()) == []
+    app.run()  # כל ריצה אחרת — הכפתור (והעותק שלו) נעלמים
+    assert not exports()
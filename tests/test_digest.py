@@ -0,0 +1,28 @@
+import quality_core as core
+
+BRANCH, DISH = core.BRANCHES[0], core.DISHES[0]
+
+
+def _insert(rows):
+    with core.db_write() as c:
+        c.executemany("""INSERT INTO food_quality (branch, chef_name, dish_name, score, notes, created_at)
+                         VALUES (?, 'a', ?, ?, ?, ?)""", [(BRANCH, DISH, s, n, t) for s, n, t in rows])
+
+
+def test_notes_sample_uses_the_time_index(db):
+    with core.db_read() as c:
+        plan = " ".join(r[3] for r in c.execute("EXPLAIN QUERY PLAN " + core.NOTES_SAMPLE_SQL, ("2025-01-01", 7.0)))
+    assert "USING INDEX idx_food_time" in plan
+    assert "SCAN food_quality" not in plan
+
+
+def test_digest_notes_come_from_the_recent_window(db):
+    _insert([(2, "ישנה מאוד", "2025-01-01 10:00:00"),
+             (3, "קר מדי", "2025-06-20 10:00:00"),
+             (9, "מושלם", "2025-06-25 10:00:00"),
+             (7, "", "2025-06-30 10:00:00")])
+    with core.db_read() as c:
+        digest = core.build_llm_digest(c)
+    notes = digest.split("## הערות נבחרות")[1]
+    assert "קר מדי" in notes and "מושלם" in notes
+    assert "ישנה מאוד" not in notes
@@ -0,0 +1,41 @@
+import pytest
+
+import quality_core as core
+from fakes import FakeOpenAI
+
+WORDS = ["תשובה ", "מלאה ", "לשאלה"]
+
+
+def ask(client, question="מה המצב?"):
+    return core.cached_answer_stream(client, "system", "prompt", question=question, version="v1")
+
+
+def test_complete_stream_is_cached(db):
+    client = FakeOpenAI(WORDS)
+    stream, from_cache = ask(client)
+    assert not from_cache
+    assert "".join(stream) == "".join(WORDS)
+    stream, from_cache = ask(client, question="  מה   המצב? ")
+    assert from_cache
+    assert "".join(stream) == "".join(WORDS).strip()
+    assert client.calls == 1
+
+
+def test_dropped_stream_is_not_cached(db):
+    client = FakeOpenAI(WORDS, fail_after=2)
+    stream, _ = ask(client)
+    with pytest.raises(ConnectionError):
+        "".join(stream)
+    assert client.closed == 1
+    _, from_cache = ask(client)
+    assert not from_cache
+
+
+def test_abandoned_stream_is_not_cached(db):
+    client = FakeOpenAI(WORDS)
+    stream, _ = ask(client)
+    next(stream)
+    stream.close()  # rerun באמצע הזרם
+    assert client.closed == 1
+    _, from_cache = ask(client)
+    assert not from_cache
@@ -0,0 +1,68 @@
+import io
+
+import pandas as pd
+import pytest
+
+import quality_core as core
+
+BRANCH, DISH = core.BRANCHES[0], core.DISHES[0]
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("2025-01-03 10:00:00", "2025-01-03 10:00:00"),
+    ("2025-01-03", "2025-01-03 00:00:00"),
+    ("2025-01-03 10:00", "2025-01-03 10:00:00"),
+    ("2025-01-03T10:00:00", "2025-01-03 10:00:00"),
+    ("2025/01/03 10:00:00", "2025-01-03 10:00:00"),
+    ("2025-01-03 10:00:00.123", "2025-01-03 10:00:00"),
+    ("2025-01-03T10:00:00+02:00", "2025-01-03 08:00:00"),
+    ("2025-01-03T10:00:00Z", "2025-01-03 10:00:00"),
+    ("2025-01-20", "2025-01-20 00:00:00"),
+    ("03/01/2025 10:00", "2025-01-03 10:00:00"),
+    ("03.01.2025", "2025-01-03 00:00:00"),
+    ("17/10/2025 12:30:00", "2025-10-17 12:30:00"),
+    ("xx", None),
+    ("31/02/2025", None),
+    ("", None),
+])
+def test_parse_import_times(raw, expected):
+    t, canon = core._parse_import_times(pd.Series([raw]))
+    got = None if pd.isna(t[0]) else t[0].strftime("%Y-%m-%d %H:%M:%S")
+    assert got == expected
+    assert canon[0] == (raw == expected)
+
+
+def _csv(times):
+    rows = "".join(f"{t},{BRANCH},chef{i},{DISH},7,\n" for i, t in enumerate(times))
+    return io.StringIO("created_at,branch,chef_name,dish_name,score,notes\n" + rows)
+
+
+def test_bad_cells_reject_rows_not_the_file(db):
+    times = ["2025-01-03 10:00:00.123", "2025-01-03T10:00:00+02:00", "xx", "17/10/2025 12:30:00"]
+    added, rejects = core.import_records(_csv(times), hours=0)
+    assert added == 3
+    assert rejects["שורה"].tolist() == [4]
+    with core.db_read() as c:
+        stored = sorted(r[0] for r in c.execute("SELECT created_at FROM food_quality"))
+        days = sorted(r[0] for r in c.execute("SELECT DISTINCT day FROM rollup_branch_dish"))
+    assert stored == ["2025-01-03 08:00:00", "2025-01-03 10:00:00", "2025-10-17 12:30:00"]
+    assert days == ["2025-01-03", "2025-10-17"]
+
+
+def test_reimport_of_non_canonical_times_adds_nothing(db):
+    times = ["17/10/2025 12:30:00", "2025/10/18 12:30:00", "2025-10-19T12:30:00", "2025-10-20"]
+    assert core.import_records(_csv(times))[0] == 4
+    added, rejects = core.import_records(_csv(times))
+    assert added == 0
+    assert rejects["סיבה"].str.startswith("כפילות").all()
+
+
+def test_failed_import_keeps_rollup_triggers(db):
+    def boom(done, total):
+        raise KeyboardInterrupt
+    with pytest.raises(KeyboardInterrupt):
+        core.import_records(_csv(["2025-01-03 10:00:00"]), progress=boom)
+    core.insert_record(BRANCH, "chef", DISH, 8, "")
+    with core.db_read() as c:
+        assert c.execute("SELECT COUNT(*) FROM food_quality").fetchone()[0] == 1
+        assert c.execute("SELECT SUM(n) FROM rollup_branch_dish").fetchone()[0] == 1
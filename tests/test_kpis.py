@@ -0,0 +1,42 @@
+import pandas as pd
+import pytest
+
+import quality_core as core
+
+BRANCH, DISH = core.BRANCHES[0], core.DISHES[0]
+
+
+@pytest.fixture
+def kpis(db):
+    for chef, score in [("a", 9), ("a", 8), ("b", 5)]:
+        core.insert_record(BRANCH, chef, DISH, score, "")
+    core.load_kpis.clear()
+    return core.load_kpis(2, 2)
+
+
+def test_kpis_from_load_kpis(kpis):
+    assert core.kpi_best_branch_by_count(kpis) == (BRANCH, 3)
+    assert core.kpi_best_avg_branch(kpis, 2) == (BRANCH, pytest.approx(22 / 3), 3)
+    assert core.kpi_top_chef(kpis, 2) == ("a", 8.5, 2)
+    assert core.kpi_top_chef(kpis) == ("a", 8.5, 2)  # None = הסף של load_kpis
+    assert core.kpi_top_dish(kpis) == (DISH, 3)
+
+
+def test_cached_result_keeps_thresholds(kpis):
+    again = core.load_kpis(2, 2)
+    assert again.attrs == {"min_n": 2, "min_m": 2}
+    assert core.kpi_best_avg_branch(again, 2)[0] == BRANCH
+
+
+def test_mismatched_threshold_raises(kpis):
+    with pytest.raises(ValueError, match="min_n"):
+        core.kpi_best_avg_branch(kpis, 5)
+    with pytest.raises(ValueError, match="min_m"):
+        core.kpi_top_chef(kpis, core.MIN_CHEF_TOP_M)
+
+
+def test_raw_inspections_frame_raises(db):
+    df = pd.DataFrame({"branch": [BRANCH], "chef_name": ["a"], "dish_name": [DISH], "score": [8]})
+    for fn in (core.kpi_best_branch_by_count, core.kpi_best_avg_branch, core.kpi_top_chef, core.kpi_top_dish):
+        with pytest.raises(ValueError, match="load_kpis"):
+            fn(df)
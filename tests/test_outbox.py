@@ -0,0 +1,143 @@
+import pytest
+
+import quality_core as core
+from fakes import APIError, FakeSheet
+
+BRANCH, DISH = core.BRANCHES[0], core.DISHES[0]
+
+
+@pytest.fixture
+def outbox(db, monkeypatch):
+    sheet = FakeSheet()
+    worker = core.SheetsOutboxWorker(core.SheetsHandle(sheet.client, "https://sheet", "sheet1"),
+                                     pool=core.db_pool(), batch_size=4, base_backoff=2.0, max_backoff=300.0,
+                                     max_attempts=5)
+    monkeypatch.setattr(core, "sheets_worker", lambda: worker)  # insert_record כותב לתור; בלי thread
+    return sheet, worker
+
+
+def enqueue(n, chef="chef"):
+    for i in range(n):
+        core.insert_record(BRANCH, f"{chef}{i}", DISH, 7, "")
+
+
+def rows():
+    with core.db_read() as c:
+        return c.execute("SELECT chef_name, attempts, next_attempt_at, last_error, synced_at FROM sheets_outbox ORDER BY id").fetchall()
+
+
+def due_now():
+    with core.db_write() as c:
+        c.execute("UPDATE sheets_outbox SET next_attempt_at = 0")
+
+
+def test_drain_syncs_in_batches(outbox):
+    sheet, worker = outbox
+    enqueue(6)
+    assert worker.drain_once() == 4
+    assert worker.drain_once() == 2
+    assert worker.drain_once() == 0
+    assert sheet.calls == [4, 2]
+    assert [r[2] for r in sheet.rows] == [f"chef{i}" for i in range(6)]
+    assert core.outbox_pending() == 0
+    assert all(r[4] is not None for r in rows())
+
+
+def test_failure_sets_backoff_and_last_error(outbox, monkeypatch):
+    sheet, worker = outbox
+    enqueue(1)
+    now = 1000.0
+    for attempt, delay in enumerate([2, 4, 8], start=1):
+        monkeypatch.setattr(core.time, "time", lambda now=now: now)
+        sheet.fail = [APIError(503, "backend unavailable")]
+        assert worker.drain_once() == 0
+        assert rows()[0][1:4] == (attempt, now + delay, "backend unavailable")
+        assert worker.drain_once() == 0  # לפני הזמן — לא נשלח שוב
+        now += delay
+    assert sheet.calls == [1, 1, 1]
+
+
+def test_failed_batches_shrink(outbox):
+    sheet, worker = outbox
+    enqueue(4)
+    sheet.fail = [APIError(503)] * 3
+    for _ in range(3):
+        worker.drain_once()
+        due_now()
+    assert sheet.calls == [4, 2, 1]  # batch_size=4, חצי מנה אחרי כל כשל
+    assert worker.drain_once() == 1
+
+
+def test_backoff_is_capped(outbox, monkeypatch):
+    sheet, worker = outbox
+    worker.max_attempts = 20
+    enqueue(1)
+    with core.db_write() as c:
+        c.execute("UPDATE sheets_outbox SET attempts = 12")
+    monkeypatch.setattr(core.time, "time", lambda: 1000.0)
+    sheet.fail = [APIError(503)]
+    worker.drain_once()
+    assert rows()[0][2] == 1000.0 + 300.0
+
+
+def test_success_clears_last_error(outbox):
+    sheet, worker = outbox
+    enqueue(1)
+    sheet.fail = [APIError(503, "boom")]
+    worker.drain_once()
+    due_now()
+    assert worker.drain_once() == 1
+    assert rows()[0][1:4:2] == (1, None)
+
+
+def test_auth_error_reconnects_within_the_same_drain(outbox):
+    sheet, worker = outbox
+    enqueue(3)
+    worker.handle.worksheet()  # handle פתוח מראש, ואז החיבור פג
+    sheet.fail = [APIError(401)]
+    assert worker.drain_once() == 3
+    assert worker.handle.stats()["reconnects"] == 1
+    assert all(r[1] == 0 for r in rows())
+
+
+def test_poison_row_is_isolated_and_dead_lettered(outbox):
+    sheet, worker = outbox
+    enqueue(4)
+    sheet.reject = lambda row: row[2] == "chef1"
+    for _ in range(10):
+        worker.drain_once()
+        due_now()
+    synced = sorted(r[2] for r in sheet.rows)
+    assert synced == ["chef0", "chef2", "chef3"]
+    assert core.outbox_pending(max_attempts=5) == 0
+    failed = core.outbox_failed(max_attempts=5)
+    assert failed["chef_name"].tolist() == ["chef1"]
+    assert failed["attempts"].tolist() == [5]
+    assert failed["last_error"].tolist() == ["invalid value"]
+    # עוד ניסיונות לא נשלחים
+    calls = len(sheet.calls)
+    assert worker.drain_once() == 0
+    assert len(sheet.calls) == calls
+
+
+def test_retry_failed_requeues(outbox, monkeypatch):
+    sheet, worker = outbox
+    monkeypatch.setattr(core, "OUTBOX_MAX_ATTEMPTS", 5)
+    enqueue(1)
+    with core.db_write() as c:
+        c.execute("UPDATE sheets_outbox SET attempts = 5, last_error = 'x'")
+    assert worker.drain_once() == 0
+    assert core.outbox_retry_failed(max_attempts=5) == 1
+    assert worker.drain_once() == 1
+    assert core.outbox_failed(max_attempts=5).empty
+
+
+def test_synced_rows_are_pruned(outbox):
+    sheet, worker = outbox
+    enqueue(2)
+    worker.drain_once()
+    with core.db_write() as c:
+        c.execute("UPDATE sheets_outbox SET synced_at = '2000-01-01 00:00:00'")
+    enqueue(1, chef="new")
+    assert worker.drain_once() == 1
+    assert [r[0] for r in rows()] == ["new0"]
@@ -0,0 +1,61 @@
+import pytest
+
+import quality_core as core
+from fakes import CREDS, APIError, FakeSheet
+
+
+@pytest.fixture
+def sheet(monkeypatch):
+    sheet = FakeSheet()
+    config = {"creds": dict(CREDS)}
+    monkeypatch.setattr(core, "_get_sheets_config", lambda: (config["creds"], "https://sheet", "sheet1"))
+    monkeypatch.setattr(core, "_authorize", sheet.client)
+    monkeypatch.setattr(core, "gsheets_available", lambda: True)
+    core._sheets_handle.clear()
+    sheet.config = config
+    yield sheet
+    core._sheets_handle.clear()
+
+
+def test_rotated_key_same_email_reconnects(sheet):
+    handle = core.get_sheets_handle()
+    handle.call(lambda ws: ws.append_rows([["a"]]))
+    # המפתח הוחלף ב-secrets (אותו client_email); ה-handle הישן מקבל 401
+    sheet.key = "k2"
+    sheet.config["creds"] = {**CREDS, "private_key": "k2"}
+    handle.call(lambda ws: ws.append_rows([["b"]]))
+    assert sheet.rows == [["a"], ["b"]]
+    assert handle.stats()["reconnects"] == 1
+    # handle חדש למפתח החדש
+    assert core.get_sheets_handle() is not handle
+
+
+def test_call_reconnects_once_on_auth_error():
+    sheet = FakeSheet()
+    handle = core.SheetsHandle(sheet.client, "https://sheet", "sheet1")
+    sheet.fail = [APIError(401)]
+    handle.call(lambda ws: ws.append_rows([["a"]]))
+    assert sheet.rows == [["a"]]
+    assert handle.stats() == {"hits": 0, "misses": 2, "reconnects": 1}
+    assert sheet.clients == 2
+    handle.call(lambda ws: ws.append_rows([["b"]]))
+    assert handle.stats()["hits"] == 1
+
+
+def test_call_does_not_retry_other_errors():
+    sheet = FakeSheet()
+    handle = core.SheetsHandle(sheet.client, "https://sheet", "sheet1")
+    sheet.fail = [APIError(500)]
+    with pytest.raises(APIError):
+        handle.call(lambda ws: ws.append_rows([["a"]]))
+    assert sheet.calls == [1]
+    assert handle.stats()["reconnects"] == 0
+
+
+def test_call_gives_up_after_one_reconnect():
+    sheet = FakeSheet()
+    handle = core.SheetsHandle(sheet.client, "https://sheet", "sheet1")
+    sheet.fail = [APIError(401), APIError(401)]
+    with pytest.raises(APIError):
+        handle.call(lambda ws: ws.append_rows([["a"]]))
+    assert sheet.calls == [1, 1]